@@ -0,0 +1,135 @@
+import os
+import cramjam
+import pyarrow as pa
+
+# Compression codec of a raw archive, by file extension
+ARCHIVE_CODECS = {'.zst': 'zstd', '.gz': 'gzip', '.lz4': 'lz4'}
+# Compression codec of a raw archive, by the magic bytes its content starts with
+ARCHIVE_MAGIC = {b'\x28\xb5\x2f\xfd': 'zstd', b'\x1f\x8b': 'gzip', b'\x04\x22\x4d\x18': 'lz4'}
+# Compression level of every codec, favouring speed since archiving runs alongside parsing
+ARCHIVE_LEVELS = {'zstd': 3, 'gzip': 6, 'lz4': 4}
+
+
+def archive_codec(path):
+    """
+    Returns the compression codec implied by the extension of a path.
+
+    Args:
+        path (str): The path of the archive.
+
+    Returns:
+        str or None: 'zstd', 'gzip' or 'lz4', or None for an uncompressed file.
+    """
+    return ARCHIVE_CODECS.get(os.path.splitext(path)[1].lower())
+
+
+def detect_codec(header):
+    """
+    Returns the compression codec of content from its first bytes.
+
+    Args:
+        header (bytes-like): The first bytes of the content, at least four of them.
+
+    Returns:
+        str or None: 'zstd', 'gzip' or 'lz4', or None for uncompressed content.
+    """
+    header = bytes(header[:4])
+    for magic, codec in ARCHIVE_MAGIC.items():
+        if header.startswith(magic):
+            return codec
+    return None
+
+
+def open_archive(raw_data):
+    """
+    Opens raw CSV data for reading, decompressing zstd, gzip and lz4 archives on the fly.
+
+    The codec is taken from the extension of a path, then from the magic bytes of the content. Decompression is
+    streamed by pyarrow, so the decompressed content is never held in memory as a whole.
+
+    Args:
+        raw_data (str, bytes, bytearray or memoryview): The path to a CSV file or archive, or its content.
+
+    Returns:
+        str or pyarrow.NativeFile: The path itself for an uncompressed file, or a readable stream.
+    """
+    if isinstance(raw_data, (bytes, bytearray, memoryview)):
+        codec = detect_codec(raw_data)
+        source = pa.BufferReader(raw_data)
+    else:
+        codec = archive_codec(raw_data)
+        if codec is None:
+            with open(raw_data, 'rb') as fread:
+                codec = detect_codec(fread.read(4))
+            if codec is None:
+                return raw_data
+        source = pa.OSFile(raw_data, 'rb')
+    if codec is None:
+        return source
+    return pa.CompressedInputStream(source, codec)
+
+
+class ArchiveWriter:
+    """
+    A streaming writer of raw archives that compresses every chunk with cramjam as it is written.
+
+    Only the compressed output of the current chunk is held in memory, so archives of any size are written with
+    flat memory use. The output is a standard zstd, gzip or lz4 frame stream, readable by open_archive and by the
+    command-line tools.
+
+    Attributes:
+        _file (file): The destination file.
+        _compressor (cramjam Compressor or None): The streaming compressor, or None to write uncompressed.
+
+    Methods:
+        write: Compresses and writes a chunk.
+        close: Finishes the stream and closes the file.
+    """
+    def __init__(self, path, codec=None):
+        """
+        Opens an archive for writing.
+
+        Args:
+            path (str): The path of the archive.
+            codec (str or None): 'zstd', 'gzip' or 'lz4', or None to use the extension of the path.
+        """
+        codec = codec or archive_codec(path)
+        self._compressor = None
+        if codec is not None:
+            self._compressor = getattr(cramjam, codec).Compressor(level=ARCHIVE_LEVELS[codec])
+        self._file = open(path, 'wb')
+
+    def write(self, chunk):
+        """
+        Compresses and writes a chunk.
+
+        Args:
+            chunk (bytes-like): The uncompressed bytes.
+
+        Returns:
+            int: The number of uncompressed bytes written.
+        """
+        if self._compressor is None:
+            return self._file.write(chunk)
+        self._compressor.compress(chunk if isinstance(chunk, bytes) else bytes(chunk))
+        self._file.write(bytes(self._compressor.flush()))
+        return len(chunk)
+
+    def close(self):
+        """
+        Finishes the compressed stream and closes the file.
+
+        Returns:
+            None
+        """
+        try:
+            if self._compressor is not None:
+                self._file.write(bytes(self._compressor.finish()))
+        finally:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
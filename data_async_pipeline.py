@@ -0,0 +1,296 @@
+import asyncio
+import concurrent.futures
+import contextlib
+import logging
+import os
+import threading
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from data_pipeline import DataPipeline, DOWNLOAD_CHUNK_SIZE
+from data_transformation import DataTransformation
+from data_validation import DataValidator, COLUMN_KINDS
+
+# Minimum number of CSV bytes gathered before a batch is handed to the parser
+PARSE_BATCH_BYTES = 8 * 1024 * 1024
+# Maximum number of items waiting between two stages
+STAGE_QUEUE_SIZE = 4
+# Seconds the download thread waits on a full queue before checking whether the run was aborted
+QUEUE_PUT_TIMEOUT = 0.5
+# Arrow type every batch parses each kind of COLUMN_KINDS column into, as the sequential parser infers for the file
+ARROW_KIND_TYPES = {'text': pa.string(), 'integer': pa.int64(), 'number': pa.float64()}
+
+
+class AsyncPipelineRunner:
+    """
+    An asyncio runner that overlaps the download, parse, validate/transform and write stages of the pipeline.
+
+    The stages are connected by bounded queues: downloaded chunks feed the parser, parsed batches feed the
+    validation and transformation, and filtered batches feed the writers. A full queue blocks the stage before it,
+    so memory stays bounded and end-to-end time approaches that of the slowest stage. Blocking work runs on worker
+    threads through asyncio.to_thread.
+
+    The parser splits the stream on line breaks, so quoted fields must not contain newlines (true of PxStat CSV).
+
+    Attributes:
+        _pipeline (DataPipeline): The pipeline used to download and to write the aggregated outputs.
+        _transformation (DataTransformation): The transformation applied to every parsed batch.
+        _validator (DataValidator): Provides the streaming validator applied to every parsed batch.
+        _fail_fast (bool): Whether the run aborts at the first batch that fails validation.
+        _queue_size (int): The maximum number of items waiting between two stages.
+        _batch_bytes (int): The minimum number of CSV bytes per parsed batch.
+        _chunk_size (int): The number of bytes read from the socket at a time.
+
+    Methods:
+        run: Runs the pipeline and blocks until it is done.
+        run_async: Runs the pipeline as a coroutine.
+    """
+    def __init__(self, pipeline=None, transformation=None, validator=None, queue_size=STAGE_QUEUE_SIZE,
+                 batch_bytes=PARSE_BATCH_BYTES, chunk_size=DOWNLOAD_CHUNK_SIZE, fail_fast=True):
+        self._pipeline = pipeline or DataPipeline()
+        self._transformation = transformation or DataTransformation()
+        self._validator = validator or DataValidator()
+        self._fail_fast = fail_fast
+        self._queue_size = queue_size
+        self._batch_bytes = batch_bytes
+        self._chunk_size = chunk_size
+
+    def run(self, data_url, output_dir):
+        """
+        Runs the pipeline and blocks until it is done.
+
+        Args:
+            data_url (str): The URL of the CSV file.
+            output_dir (str): The directory receiving results1/results2 as CSV and Parquet files.
+
+        Returns:
+            dict: The aggregated DataFrame under 'aggregated', the number of parsed and filtered rows under 'rows'
+            and 'filtered_rows', and the validation report of the whole stream under 'validation'.
+
+        Raises:
+            ValidationError: If a batch fails validation and the runner fails fast. The download is stopped.
+            ValueError: If the response is empty. A header-only file writes outputs without rows.
+        """
+        return asyncio.run(self.run_async(data_url, output_dir))
+
+    async def run_async(self, data_url, output_dir):
+        """
+        Runs the pipeline as a coroutine.
+
+        Args:
+            data_url (str): The URL of the CSV file.
+            output_dir (str): The directory receiving results1/results2 as CSV and Parquet files.
+
+        Returns:
+            dict: See run.
+        """
+        chunks = asyncio.Queue(self._queue_size)
+        batches = asyncio.Queue(self._queue_size)
+        filtered = asyncio.Queue(self._queue_size)
+        stop = threading.Event()
+        summary = {'aggregated': None, 'rows': 0, 'filtered_rows': 0, 'validation': None}
+        stream_validator = self._validator.streaming(self._fail_fast)
+        filter_paths = {'csv': os.path.join(output_dir, 'results2.csv'),
+                        'parquet': os.path.join(output_dir, 'results2.parquet')}
+
+        tasks = [asyncio.ensure_future(self._download(data_url, chunks, stop)),
+                 asyncio.ensure_future(self._parse(chunks, batches)),
+                 asyncio.ensure_future(self._transform(batches, filtered, summary, stream_validator)),
+                 asyncio.ensure_future(self._write_filtered(filtered, filter_paths, summary))]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            stop.set()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+        aggregated = summary['aggregated']
+        if aggregated is None:
+            raise ValueError('The CSV file at %s is empty, not even a header was received' % data_url)
+        await asyncio.to_thread(self._pipeline.write_outputs,
+                                [(aggregated, 'csv', os.path.join(output_dir, 'results1.csv')),
+                                 (aggregated, 'parquet', os.path.join(output_dir, 'results1.parquet'))])
+        logging.info('Asynchronous run finished: %d rows, %d filtered rows', summary['rows'],
+                     summary['filtered_rows'])
+        return summary
+
+    async def _download(self, data_url, chunks, stop):
+        """
+        Download stage: streams the response on a worker thread and puts its chunks on the queue.
+
+        Args:
+            data_url (str): The URL of the CSV file.
+            chunks (asyncio.Queue): The queue of downloaded chunks, closed with None.
+            stop (threading.Event): Set when the run is aborted.
+        """
+        loop = asyncio.get_running_loop()
+
+        def put(chunk):
+            future = asyncio.run_coroutine_threadsafe(chunks.put(chunk), loop)
+            while True:
+                try:
+                    return future.result(QUEUE_PUT_TIMEOUT)
+                except concurrent.futures.TimeoutError:
+                    if stop.is_set():
+                        future.cancel()
+                        raise
+
+        def download():
+            with contextlib.closing(self._pipeline.iter_csv_chunks(data_url, self._chunk_size)) as stream:
+                for chunk in stream:
+                    put(chunk)
+
+        try:
+            await asyncio.to_thread(download)
+        finally:
+            if not stop.is_set():
+                await chunks.put(None)
+
+    async def _parse(self, chunks, batches):
+        """
+        Parse stage: cuts the byte stream into batches of complete lines and parses them on a worker thread.
+
+        The known columns are parsed with the types of COLUMN_KINDS rather than inferred per batch, so a float
+        that only appears in a later batch does not break its parse and all batches share one schema.
+
+        Args:
+            chunks (asyncio.Queue): The queue of downloaded chunks, closed with None.
+            batches (asyncio.Queue): The queue of parsed DataFrames, closed with None.
+        """
+        header = None
+        pending = bytearray()
+        column_types = {column: ARROW_KIND_TYPES[kind] for column, kind in COLUMN_KINDS.items()}
+        parsed_batches = 0
+        while True:
+            chunk = await chunks.get()
+            if chunk is not None:
+                pending += chunk
+                if header is None:
+                    end_of_header = pending.find(b'\n')
+                    if end_of_header < 0:
+                        continue
+                    header = bytes(pending[:end_of_header + 1])
+                    del pending[:end_of_header + 1]
+                if len(pending) < self._batch_bytes:
+                    continue
+                end_of_lines = pending.rfind(b'\n') + 1
+                if end_of_lines == 0:
+                    continue
+                body = bytes(pending[:end_of_lines])
+                del pending[:end_of_lines]
+            else:
+                if header is None and pending.strip():
+                    # A header without a line break, and no rows
+                    header, pending = bytes(pending) + b'\n', bytearray()
+                body = bytes(pending)
+            # A header-only file still yields one empty batch, so the outputs get their columns
+            if header is not None and (body.strip() or (chunk is None and parsed_batches == 0)):
+                batch = await asyncio.to_thread(self._parse_batch, header + body, column_types)
+                parsed_batches += 1
+                await batches.put(batch)
+            if chunk is None:
+                await batches.put(None)
+                return
+
+    def _parse_batch(self, raw_data, column_types):
+        """
+        Parses one batch of CSV lines preceded by the header and converts it to pandas, on a worker thread.
+
+        Args:
+            raw_data (bytes): The header followed by complete CSV lines.
+            column_types (dict): The Arrow type of every known column; the other columns are inferred.
+
+        Returns:
+            pandas.DataFrame: The parsed batch.
+        """
+        convert_options = pa_csv.ConvertOptions(column_types=column_types)
+        return pa_csv.read_csv(pa.BufferReader(raw_data), convert_options=convert_options).to_pandas()
+
+    async def _transform(self, batches, filtered, summary, stream_validator):
+        """
+        Validate/transform stage: validates every batch, merges its partial sums and passes on its filtered rows.
+
+        Args:
+            batches (asyncio.Queue): The queue of parsed DataFrames, closed with None.
+            filtered (asyncio.Queue): The queue of filtered DataFrames, closed with None.
+            summary (dict): The summary of the run, updated in place.
+            stream_validator (StreamingValidator): Accumulates the validation report over the batches.
+        """
+        while True:
+            batch = await batches.get()
+            if batch is None:
+                summary['validation'] = stream_validator.finish()
+                await filtered.put(None)
+                return
+            partial, filter_batch = await asyncio.to_thread(self._transform_batch, batch, stream_validator)
+            summary['aggregated'] = self._transformation.merge_partials(summary['aggregated'], partial)
+            summary['rows'] += len(batch)
+            await filtered.put(filter_batch)
+
+    def _transform_batch(self, batch, stream_validator):
+        """
+        Validates, aggregates and filters one parsed batch.
+
+        Args:
+            batch (pandas.DataFrame): The parsed batch.
+            stream_validator (StreamingValidator): Validates the batch in a single pass.
+
+        Returns:
+            Tuple[pandas.DataFrame, pandas.DataFrame]: The partial sums and the filtered rows of the batch.
+        """
+        stream_validator.update(batch)
+        data_lowercase = self._transformation.all_column_lower_case(batch)
+        partial = self._transformation.aggregator_group(data_lowercase)
+        return partial, self._transformation.data_filter(data_lowercase)
+
+    async def _write_filtered(self, filtered, filter_paths, summary):
+        """
+        Write stage: appends every filtered batch to temporary CSV and Parquet files and renames them into place.
+
+        Args:
+            filtered (asyncio.Queue): The queue of filtered DataFrames, closed with None.
+            filter_paths (dict): The output path of every format.
+            summary (dict): The summary of the run, updated in place.
+        """
+        writers = {'parquet': None, 'empty': None}
+        tmp_paths = {data_format: path + '.tmp' for data_format, path in filter_paths.items()}
+        try:
+            first = True
+            while True:
+                filter_batch = await filtered.get()
+                if filter_batch is None:
+                    break
+                await asyncio.to_thread(self._append_filtered, filter_batch, tmp_paths, writers, first)
+                summary['filtered_rows'] += len(filter_batch)
+                first = False
+        finally:
+            if writers['parquet'] is not None:
+                writers['parquet'].close()
+        if writers['parquet'] is None and writers['empty'] is not None:
+            await asyncio.to_thread(self._pipeline.save_data_to_parquet, writers['empty'], tmp_paths['parquet'])
+        for data_format, path in filter_paths.items():
+            if os.path.exists(tmp_paths[data_format]):
+                os.replace(tmp_paths[data_format], path)
+
+    def _append_filtered(self, filter_batch, tmp_paths, writers, first):
+        """
+        Appends one filtered batch to the temporary CSV and Parquet files.
+
+        Args:
+            filter_batch (pandas.DataFrame): The filtered rows of one batch.
+            tmp_paths (dict): The temporary path of every format.
+            writers (dict): Holds the open pyarrow.parquet.ParquetWriter under 'parquet', and the last empty batch
+                under 'empty' until a non-empty batch opens the writer.
+            first (bool): Whether this is the first batch, which creates the CSV file.
+        """
+        filter_batch.to_csv(tmp_paths['csv'], index=False, mode='w' if first else 'a', header=first)
+        if filter_batch.empty:
+            # Empty object columns have no Arrow type yet, so the Parquet schema is taken from a non-empty batch
+            writers['empty'] = filter_batch
+            return
+        table = pa.Table.from_pandas(filter_batch, preserve_index=False)
+        if writers['parquet'] is None:
+            writers['parquet'] = pq.ParquetWriter(tmp_paths['parquet'], table.schema)
+        writers['parquet'].write_table(table.cast(writers['parquet'].schema))
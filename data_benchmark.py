@@ -0,0 +1,409 @@
+import argparse
+import datetime
+import functools
+import json
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+from data_metrics import PipelineMetrics
+from data_pipeline import DataPipeline
+from data_transformation import DataTransformation
+from data_validation import DataValidator
+
+# Row counts used when no sizes are passed on the command line
+AGGREGATION_BENCHMARK_SIZES = [1000000, 10000000, 50000000]
+# Row counts of the pipeline suite when no sizes are passed on the command line (up to 10**8 can be passed)
+SUITE_BENCHMARK_SIZES = [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6]
+# Largest row count the pipeline suite loads whole into memory; larger sizes are streamed to disk and transformed
+# in chunks, since the in-memory path needs several times the size of the file in RAM
+IN_MEMORY_BENCHMARK_ROWS = 10 ** 7
+# Number of synthetic rows generated and written per batch
+GENERATOR_BATCH_ROWS = 1000000
+# A stage slower than the previous run by more than this factor is reported as a regression
+REGRESSION_THRESHOLD = 1.25
+
+# Distinct values of the EDA14 columns, matching the cardinalities of the published cube
+EDA14_STATISTICS = ['EDA14C01', 'EDA14C02', 'EDA14C03', 'EDA14C04', 'EDA14C05', 'EDA14C06', 'EDA14C07',
+                    'EDA14C08']
+EDA14_STATISTIC_LABELS = ['First Year Students', 'Second Year Students', 'Third Year Students',
+                          'Transition Year Students', 'Fifth Year Students', 'Sixth Year Students',
+                          'Post Leaving Certificate Students', 'Other Second Level Students']
+EDA14_SCHOOL_CODES = [10, 20, 30, 40]
+EDA14_SCHOOL_TYPES = ['Secondary School', 'Vocational School', 'Community and Comprehensive School',
+                      'All second level schools']
+EDA14_SEX_CODES = ['-', '1', '2']
+EDA14_SEXES = ['Both sexes', 'Male', 'Female']
+EDA14_FIRST_YEAR = 1950
+EDA14_LAST_YEAR = 2022
+
+
+def legacy_aggregator_group(data_lowercase):
+    """
+    The original lambda-based implementation of DataTransformation.aggregator_group, kept as a baseline.
+
+    Args:
+        data_lowercase (pandas.DataFrame): The DataFrame to perform grouping and aggregation on.
+
+    Returns:
+        pandas.DataFrame: The resulting DataFrame with grouped and aggregated data.
+    """
+    data = data_lowercase
+    data['year'] = data['year'].astype(int)
+    data['year_group'] = data['year'] // 5 * 5
+    return data.groupby(['year_group']).agg(female=('value', lambda x: x[data['sex'] == 'Female'].sum()),
+                                            male=('value', lambda x: x[data['sex'] == 'Male'].sum()),
+                                            both_sexes=('value', 'sum'))
+
+
+def generate_aggregation_frame(rows, seed=0):
+    """
+    Generates a frame with the lowercase 'year', 'sex' and 'value' columns used by the aggregation.
+
+    Args:
+        rows (int): The number of rows to generate.
+        seed (int): The seed of the random generator.
+
+    Returns:
+        pandas.DataFrame: The generated DataFrame.
+    """
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'year': rng.integers(1950, 2023, rows),
+        'sex': pd.Categorical.from_codes(rng.integers(0, 3, rows), ['Both sexes', 'Female', 'Male']).astype(object),
+        'value': rng.integers(0, 5000, rows).astype(float)
+    })
+
+
+def time_call(function, *args):
+    """
+    Times a single call of the given function.
+
+    Args:
+        function (callable): The function to call.
+        *args: The positional arguments passed to the function.
+
+    Returns:
+        Tuple[float, object]: The elapsed wall time in seconds and the return value of the call.
+    """
+    start_time = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start_time, result
+
+
+def benchmark_aggregation(sizes):
+    """
+    Compares the legacy and the vectorized aggregator_group implementations on generated data.
+
+    Args:
+        sizes (list): The row counts to benchmark.
+
+    Returns:
+        list: One dictionary per size with the timings of both implementations and the speedup.
+    """
+    results = []
+    for rows in sizes:
+        data = generate_aggregation_frame(rows)
+        legacy_time, expected = time_call(legacy_aggregator_group, data.copy())
+        vectorized_time, actual = time_call(DataTransformation().aggregator_group, data.copy())
+        pd.testing.assert_frame_equal(actual, expected)
+        results.append({'rows': rows, 'legacy_seconds': legacy_time, 'vectorized_seconds': vectorized_time,
+                        'speedup': legacy_time / vectorized_time})
+        print(f"{rows:>12,} rows  legacy {legacy_time:8.3f}s  vectorized {vectorized_time:8.3f}s  "
+              f"speedup {legacy_time / vectorized_time:6.1f}x")
+    return results
+
+
+def generate_eda14_frame(rows, seed=0):
+    """
+    Generates a synthetic DataFrame shaped like the EDA14 cube: same columns, dtypes and cardinalities.
+
+    Args:
+        rows (int): The number of rows to generate.
+        seed (int): The seed of the random generator.
+
+    Returns:
+        pandas.DataFrame: The generated DataFrame.
+    """
+    rng = np.random.default_rng(seed)
+    statistic = rng.integers(0, len(EDA14_STATISTICS), rows)
+    school = rng.integers(0, len(EDA14_SCHOOL_CODES), rows)
+    sex = rng.integers(0, len(EDA14_SEXES), rows)
+    year = rng.integers(EDA14_FIRST_YEAR, EDA14_LAST_YEAR + 1, rows)
+    return pd.DataFrame({
+        'STATISTIC': np.array(EDA14_STATISTICS, dtype=object)[statistic],
+        'Statistic Label': np.array(EDA14_STATISTIC_LABELS, dtype=object)[statistic],
+        'C02351V02955': np.array(EDA14_SCHOOL_CODES)[school],
+        'Type of School': np.array(EDA14_SCHOOL_TYPES, dtype=object)[school],
+        'C02199V02655': np.array(EDA14_SEX_CODES, dtype=object)[sex],
+        'Sex': np.array(EDA14_SEXES, dtype=object)[sex],
+        'TLIST(A1)': year,
+        'Year': year,
+        'UNIT': 'Number',
+        'VALUE': rng.integers(0, 50000, rows).astype(float)
+    })
+
+
+def generate_eda14_csv(path, rows, seed=0):
+    """
+    Writes a synthetic EDA14-shaped CSV file, generating it in batches so any size fits in memory.
+
+    Args:
+        path (str): The path to the CSV file.
+        rows (int): The number of rows to generate.
+        seed (int): The seed of the random generator.
+
+    Returns:
+        int: The size of the file in bytes.
+    """
+    writer = None
+    try:
+        for batch_number, start in enumerate(range(0, rows, GENERATOR_BATCH_ROWS)):
+            batch = generate_eda14_frame(min(GENERATOR_BATCH_ROWS, rows - start), seed + batch_number)
+            table = pa.Table.from_pandas(batch, preserve_index=False)
+            if writer is None:
+                writer = pa_csv.CSVWriter(path, table.schema,
+                                          write_options=pa_csv.WriteOptions(quoting_style='none'))
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+    return os.path.getsize(path)
+
+
+class LocalFileServer:
+    """
+    A local HTTP file server standing in for the PxStat API during benchmarks.
+
+    Attributes:
+        _server (ThreadingHTTPServer): The HTTP server.
+        _thread (threading.Thread): The thread running the server.
+        base_url (str): The URL of the served directory.
+
+    Methods:
+        close: Stops the server.
+    """
+    def __init__(self, directory):
+        handler = functools.partial(_QuietFileRequestHandler, directory=directory)
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.base_url = 'http://127.0.0.1:%d/' % self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """
+        Stops the server.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class _QuietFileRequestHandler(SimpleHTTPRequestHandler):
+    """
+    A SimpleHTTPRequestHandler that does not log every request to stderr.
+    """
+    def log_message(self, format, *args):
+        pass
+
+
+def benchmark_pipeline(sizes, seed=0):
+    """
+    Runs every pipeline stage on synthetic EDA14-shaped data of each size.
+
+    The CSV file is served by a local HTTP server and downloaded, parsed, validated, aggregated, filtered and
+    written to CSV and Parquet. Sizes above IN_MEMORY_BENCHMARK_ROWS are streamed to a local file and run through
+    data_transform_chunked instead, so they record a 'transform_chunked' stage in place of the parse, validate,
+    aggregation and filter stages, and write the filtered rows to CSV only.
+
+    Args:
+        sizes (list): The row counts to benchmark.
+        seed (int): The seed of the random generator.
+
+    Returns:
+        list: One dictionary per size and stage with the metrics recorded by PipelineMetrics.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        server = LocalFileServer(tmp_dir)
+        try:
+            for rows in sizes:
+                file_name = 'eda14_%d.csv' % rows
+                generate_eda14_csv(os.path.join(tmp_dir, file_name), rows, seed)
+                metrics = PipelineMetrics()
+                data_pipeline = DataPipeline(metrics=metrics)
+                transformation = DataTransformation()
+
+                if rows > IN_MEMORY_BENCHMARK_ROWS:
+                    benchmark_streamed(data_pipeline, server.base_url + file_name, tmp_dir, rows, metrics)
+                    os.remove(os.path.join(tmp_dir, file_name))
+                    results.extend(report_stages(metrics, rows))
+                    continue
+
+                raw_data = data_pipeline.download_csv_bytes(server.base_url + file_name)
+                data = data_pipeline.convert_to_dataframe(raw_data)
+                del raw_data
+                DataValidator(metrics).validate(data)
+                data_lowercase = transformation.all_column_lower_case(data)
+                with metrics.stage('aggregator_group', rows):
+                    aggregated = transformation.aggregator_group(data_lowercase)
+                with metrics.stage('data_filter', rows):
+                    filtered = transformation.data_filter(data_lowercase)
+                data_pipeline.write_outputs([(aggregated, 'csv', os.path.join(tmp_dir, 'results1.csv')),
+                                             (filtered, 'csv', os.path.join(tmp_dir, 'results2.csv'))],
+                                            max_workers=1)
+                data_pipeline.write_outputs([(aggregated, 'parquet', os.path.join(tmp_dir, 'results1.parquet')),
+                                             (filtered, 'parquet', os.path.join(tmp_dir, 'results2.parquet'))],
+                                            max_workers=1)
+                os.remove(os.path.join(tmp_dir, file_name))
+                results.extend(report_stages(metrics, rows))
+        finally:
+            server.close()
+    return results
+
+
+def benchmark_streamed(data_pipeline, data_url, tmp_dir, rows, metrics):
+    """
+    Runs the pipeline with flat memory use: streams the CSV file to disk and transforms it in chunks.
+
+    Args:
+        data_pipeline (DataPipeline): The pipeline recording its stages in metrics.
+        data_url (str): The URL of the CSV file.
+        tmp_dir (str): The directory receiving the download and the outputs.
+        rows (int): The number of rows of the file.
+        metrics (PipelineMetrics): The metrics collector.
+
+    Returns:
+        None
+    """
+    download_path = os.path.join(tmp_dir, 'download.csv')
+    data_pipeline.stream_csv_data(data_url, download_path)
+    with metrics.stage('transform_chunked', rows):
+        aggregated, _ = DataTransformation().data_transform_chunked(
+            download_path, os.path.join(tmp_dir, 'results2.csv'), validator=DataValidator(metrics).streaming())
+    os.remove(download_path)
+    data_pipeline.write_outputs([(aggregated, 'csv', os.path.join(tmp_dir, 'results1.csv')),
+                                 (aggregated, 'parquet', os.path.join(tmp_dir, 'results1.parquet'))],
+                                max_workers=1)
+
+
+def report_stages(metrics, rows):
+    """
+    Prints the recorded stages of one size and returns them labelled with the size.
+
+    Args:
+        metrics (PipelineMetrics): The metrics collector.
+        rows (int): The number of rows benchmarked.
+
+    Returns:
+        list: The records of the stages, each with its 'size'.
+    """
+    records = metrics.to_dict()
+    for record in records:
+        record['size'] = rows
+        print(f"{rows:>12,} rows  {record['stage']:<24} {record['wall_seconds']:8.3f}s")
+    return records
+
+
+def current_version():
+    """
+    Returns the version label stored with benchmark results.
+
+    Returns:
+        str: The current git commit, or 'unknown' outside a git checkout.
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def load_results(results_path):
+    """
+    Loads the benchmark runs stored by previous versions.
+
+    Args:
+        results_path (str): The path to the JSON lines results file.
+
+    Returns:
+        list: One dictionary per stored run, oldest first.
+    """
+    if not os.path.exists(results_path):
+        return []
+    with open(results_path, 'r', encoding='utf-8') as fread:
+        return [json.loads(line) for line in fread if line.strip()]
+
+
+def store_results(results_path, results):
+    """
+    Appends a benchmark run to the results file.
+
+    Args:
+        results_path (str): The path to the JSON lines results file.
+        results (list): The records returned by benchmark_pipeline.
+
+    Returns:
+        dict: The stored run.
+    """
+    run = {'version': current_version(), 'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+           'results': results}
+    with open(results_path, 'a', encoding='utf-8') as fwrite:
+        fwrite.write(json.dumps(run) + '\n')
+    return run
+
+
+def find_regressions(previous_run, results, threshold=REGRESSION_THRESHOLD):
+    """
+    Compares a benchmark run with a previous one.
+
+    Args:
+        previous_run (dict): A run returned by load_results.
+        results (list): The records returned by benchmark_pipeline.
+        threshold (float): The slowdown factor above which a stage is reported.
+
+    Returns:
+        list: One dictionary per regressed size and stage, with the previous and current wall times.
+    """
+    previous = {(record['size'], record['stage']): record['wall_seconds'] for record in previous_run['results']}
+    regressions = []
+    for record in results:
+        before = previous.get((record['size'], record['stage']))
+        if before and record['wall_seconds'] > before * threshold:
+            regressions.append({'size': record['size'], 'stage': record['stage'], 'previous_seconds': before,
+                                'current_seconds': record['wall_seconds'], 'version': previous_run['version']})
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the data pipeline on synthetic EDA14-shaped data.')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+    aggregation_parser = subparsers.add_parser('aggregation', help='compare the legacy and vectorized aggregation')
+    aggregation_parser.add_argument('sizes', nargs='*', type=int, default=AGGREGATION_BENCHMARK_SIZES,
+                                    help='row counts to benchmark')
+    suite_parser = subparsers.add_parser('suite', help='run every pipeline stage and check for regressions')
+    suite_parser.add_argument('sizes', nargs='*', type=int, default=SUITE_BENCHMARK_SIZES,
+                              help='row counts to benchmark, from 10**3 to 10**8; sizes above %d are streamed'
+                                   % IN_MEMORY_BENCHMARK_ROWS)
+    suite_parser.add_argument('--results', default='benchmark_results.jsonl',
+                              help='JSON lines file storing the runs of every version')
+    suite_parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                              help='slowdown factor reported as a regression')
+    args = parser.parse_args()
+
+    if args.benchmark == 'aggregation':
+        benchmark_aggregation(args.sizes)
+    else:
+        previous_runs = load_results(args.results)
+        suite_results = benchmark_pipeline(args.sizes)
+        store_results(args.results, suite_results)
+        if previous_runs:
+            for regression in find_regressions(previous_runs[-1], suite_results, args.threshold):
+                print(f"REGRESSION {regression['size']:>12,} rows  {regression['stage']:<24} "
+                      f"{regression['previous_seconds']:.3f}s ({regression['version']}) -> "
+                      f"{regression['current_seconds']:.3f}s")
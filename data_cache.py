@@ -0,0 +1,392 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+
+# Default upper bound on the total size of the cached response bodies
+DOWNLOAD_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+# Default upper bounds on the number and the total size of the cached transformation results
+RESULT_CACHE_MAX_ENTRIES = 16
+RESULT_CACHE_MAX_BYTES = 4 * 1024 * 1024 * 1024
+# Number of bytes read at a time when hashing a file
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def content_hash(raw_data, params=None):
+    """
+    Hashes input content together with the parameters it is processed with.
+
+    Args:
+        raw_data (str, bytes, bytearray or memoryview): The path to a file, or the content itself.
+        params (dict or None): JSON-serialisable parameters that change the result of processing the content.
+
+    Returns:
+        str: The hex SHA-256 digest.
+    """
+    digest = hashlib.sha256()
+    if isinstance(raw_data, (bytes, bytearray, memoryview)):
+        digest.update(raw_data)
+    else:
+        with open(raw_data, 'rb') as fread:
+            for block in iter(lambda: fread.read(HASH_BLOCK_SIZE), b''):
+                digest.update(block)
+    digest.update(json.dumps(params or {}, sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class DownloadCache:
+    """
+    An on-disk cache of downloaded datasets that supports HTTP conditional requests.
+
+    Every cached URL is stored as a body file plus a small JSON metadata file holding the ETag and Last-Modified
+    values of the response. Least recently used bodies are evicted once the total size exceeds max_bytes.
+
+    Attributes:
+        _cache_dir (str): The directory holding the cached files.
+        _max_bytes (int): The upper bound on the total size of the cached bodies.
+
+    Methods:
+        conditional_headers: Returns the If-None-Match/If-Modified-Since headers for a cached URL.
+        load: Returns the cached body of a URL.
+        copy_to: Copies the cached body of a URL to a file.
+        store: Stores a response body and its validators.
+        store_file: Stores a downloaded file and its validators.
+        evict: Removes least recently used entries until the cache fits in max_bytes.
+    """
+    def __init__(self, cache_dir, max_bytes=DOWNLOAD_CACHE_MAX_BYTES):
+        self._cache_dir = cache_dir
+        self._max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _paths(self, url):
+        """
+        Returns the body and metadata paths used for the given URL.
+
+        Args:
+            url (str): The URL of the dataset.
+
+        Returns:
+            Tuple[str, str]: The path of the body file and the path of the metadata file.
+        """
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self._cache_dir, key + '.body'), os.path.join(self._cache_dir, key + '.json')
+
+    def _read_meta(self, url):
+        """
+        Reads the metadata of a cached URL.
+
+        Args:
+            url (str): The URL of the dataset.
+
+        Returns:
+            dict or None: The metadata, or None if the URL is not cached.
+        """
+        body_path, meta_path = self._paths(url)
+        if not os.path.exists(body_path):
+            return None
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as fread:
+                return json.load(fread)
+        except (OSError, ValueError):
+            return None
+
+    def conditional_headers(self, url):
+        """
+        Returns the request headers that let the server answer 304 Not Modified for a cached URL.
+
+        Args:
+            url (str): The URL of the dataset.
+
+        Returns:
+            dict: The If-None-Match and If-Modified-Since headers, empty if the URL is not cached.
+        """
+        meta = self._read_meta(url)
+        headers = {}
+        if meta is None:
+            return headers
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+
+    def load(self, url):
+        """
+        Returns the cached body of a URL and marks it as recently used.
+
+        Args:
+            url (str): The URL of the dataset.
+
+        Returns:
+            bytes or None: The cached body, or None if the URL is not cached.
+        """
+        body_path, _ = self._paths(url)
+        try:
+            with open(body_path, 'rb') as fread:
+                content = fread.read()
+        except OSError:
+            return None
+        os.utime(body_path)
+        return content
+
+    def copy_to(self, url, destination_folder):
+        """
+        Copies the cached body of a URL to a file and marks it as recently used.
+
+        Args:
+            url (str): The URL of the dataset.
+            destination_folder (str): The path to the destination file.
+
+        Returns:
+            int or None: The number of bytes copied, or None if the URL is not cached.
+
+        Raises:
+            OSError: If the destination file cannot be written.
+        """
+        body_path, _ = self._paths(url)
+        try:
+            fread = open(body_path, 'rb')
+        except OSError:
+            return None
+        with fread, open(destination_folder, 'wb') as fwrite:
+            shutil.copyfileobj(fread, fwrite)
+        os.utime(body_path)
+        return os.path.getsize(destination_folder)
+
+    def store(self, url, content, headers):
+        """
+        Stores a response body when the response carries an ETag or Last-Modified validator.
+
+        Args:
+            url (str): The URL of the dataset.
+            content (bytes): The response body.
+            headers (Mapping): The response headers.
+
+        Returns:
+            bool: True if the body was cached, False otherwise.
+        """
+        return self._store(url, headers, lambda tmp_path: self._write_bytes(tmp_path, content))
+
+    def store_file(self, url, source_path, headers):
+        """
+        Stores a downloaded file when the response carries an ETag or Last-Modified validator.
+
+        Args:
+            url (str): The URL of the dataset.
+            source_path (str): The path of the downloaded file.
+            headers (Mapping): The response headers.
+
+        Returns:
+            bool: True if the file was cached, False otherwise.
+        """
+        return self._store(url, headers, lambda tmp_path: shutil.copyfile(source_path, tmp_path))
+
+    def _write_bytes(self, path, content):
+        """
+        Writes bytes to a file.
+
+        Args:
+            path (str): The path of the file.
+            content (bytes): The bytes to write.
+        """
+        with open(path, 'wb') as fwrite:
+            fwrite.write(content)
+
+    def _store(self, url, headers, write_body):
+        """
+        Writes a cache entry atomically and evicts old entries.
+
+        Args:
+            url (str): The URL of the dataset.
+            headers (Mapping): The response headers.
+            write_body (callable): Writes the body to the temporary path it is given.
+
+        Returns:
+            bool: True if the entry was cached, False otherwise.
+        """
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        if not etag and not last_modified:
+            return False
+        body_path, meta_path = self._paths(url)
+        try:
+            write_body(body_path + '.tmp')
+            os.replace(body_path + '.tmp', body_path)
+            with open(meta_path + '.tmp', 'w', encoding='utf-8') as fwrite:
+                json.dump({'url': url, 'etag': etag, 'last_modified': last_modified}, fwrite)
+            os.replace(meta_path + '.tmp', meta_path)
+        except OSError as e:
+            logging.info('Cannot write to the download cache :: %s', e)
+            return False
+        self.evict()
+        return True
+
+    def evict(self):
+        """
+        Removes least recently used entries until the total size of the bodies fits in max_bytes.
+
+        Returns:
+            int: The number of entries removed.
+        """
+        entries = []
+        for name in os.listdir(self._cache_dir):
+            if name.endswith('.body'):
+                try:
+                    stat = os.stat(os.path.join(self._cache_dir, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name[:-len('.body')]))
+        total_bytes = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, key in sorted(entries):
+            if total_bytes <= self._max_bytes:
+                break
+            for suffix in ('.body', '.json'):
+                try:
+                    os.remove(os.path.join(self._cache_dir, key + suffix))
+                except OSError:
+                    pass
+            total_bytes -= size
+            removed += 1
+        return removed
+
+
+class ResultCache:
+    """
+    An on-disk cache of pipeline outputs keyed by the content hash of the input and the transformation parameters.
+
+    A hit points at copies of the outputs kept in the cache, so validation, transformation and writing can be
+    skipped. Entries are evicted least recently used first once there are more than max_entries of them or they
+    take more than max_bytes.
+
+    Attributes:
+        _cache_dir (str): The directory holding one sub-directory per entry and the index file.
+        _max_entries (int): The upper bound on the number of entries.
+        _max_bytes (int): The upper bound on the total size of the entries.
+        _metrics (PipelineMetrics or None): Receives the result_cache_hits/misses/evictions counters.
+        stats (dict): The number of hits, misses and evictions since the cache was created.
+
+    Methods:
+        lookup: Returns the stored outputs of a key.
+        store: Stores the outputs of a key.
+    """
+    def __init__(self, cache_dir, max_entries=RESULT_CACHE_MAX_ENTRIES, max_bytes=RESULT_CACHE_MAX_BYTES,
+                 metrics=None):
+        self._cache_dir = cache_dir
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._metrics = metrics
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _count(self, name):
+        """
+        Increments one of the hit/miss/eviction statistics.
+
+        Args:
+            name (str): 'hits', 'misses' or 'evictions'.
+        """
+        self.stats[name] += 1
+        if self._metrics is not None:
+            self._metrics.increment('result_cache_' + name)
+
+    def _read_index(self):
+        """
+        Reads the index of the cache.
+
+        Returns:
+            dict: The entries by key, each with its 'files', 'bytes' and 'last_used' time.
+        """
+        try:
+            with open(os.path.join(self._cache_dir, 'index.json'), 'r', encoding='utf-8') as fread:
+                return json.load(fread)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_index(self, index):
+        """
+        Replaces the index of the cache atomically.
+
+        Args:
+            index (dict): The entries by key.
+        """
+        index_path = os.path.join(self._cache_dir, 'index.json')
+        with open(index_path + '.tmp', 'w', encoding='utf-8') as fwrite:
+            json.dump(index, fwrite)
+        os.replace(index_path + '.tmp', index_path)
+
+    def lookup(self, key):
+        """
+        Returns the stored outputs of a key and marks the entry as recently used.
+
+        Args:
+            key (str): The key returned by content_hash.
+
+        Returns:
+            dict or None: The path of every stored output by name, or None on a miss.
+        """
+        index = self._read_index()
+        entry = index.get(key)
+        outputs = None
+        if entry is not None:
+            outputs = {name: os.path.join(self._cache_dir, key, name) for name in entry['files']}
+            if not all(os.path.exists(path) for path in outputs.values()):
+                outputs = None
+        if outputs is None:
+            self._count('misses')
+            return None
+        entry['last_used'] = time.time()
+        self._write_index(index)
+        self._count('hits')
+        return outputs
+
+    def store(self, key, outputs):
+        """
+        Copies the outputs of a key into the cache and evicts old entries.
+
+        Args:
+            key (str): The key returned by content_hash.
+            outputs (dict): The path of every output file or directory, by name.
+
+        Returns:
+            dict: The path of every stored output by name.
+        """
+        entry_dir = os.path.join(self._cache_dir, key)
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.makedirs(entry_dir)
+        total_bytes = 0
+        stored = {}
+        for name, path in outputs.items():
+            stored[name] = os.path.join(entry_dir, name)
+            if os.path.isdir(path):
+                shutil.copytree(path, stored[name])
+                total_bytes += sum(os.path.getsize(os.path.join(root, file_name))
+                                   for root, _, file_names in os.walk(stored[name]) for file_name in file_names)
+            else:
+                shutil.copyfile(path, stored[name])
+                total_bytes += os.path.getsize(stored[name])
+        index = self._read_index()
+        index[key] = {'files': sorted(outputs), 'bytes': total_bytes, 'last_used': time.time()}
+        self._evict(index, key)
+        self._write_index(index)
+        return stored
+
+    def _evict(self, index, keep):
+        """
+        Removes least recently used entries until the cache fits in max_entries and max_bytes.
+
+        Args:
+            index (dict): The entries by key, updated in place.
+            keep (str): The key of the entry just stored, which is never evicted.
+        """
+        for key in sorted(index, key=lambda entry_key: index[entry_key]['last_used']):
+            total_bytes = sum(entry['bytes'] for entry in index.values())
+            if len(index) <= self._max_entries and total_bytes <= self._max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self._cache_dir, key), ignore_errors=True)
+            del index[key]
+            self._count('evictions')
@@ -0,0 +1,159 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import pyarrow as pa
+
+# Environment variable overriding the log destination: a file path, or '-' for standard error
+LOG_DESTINATION_ENV = 'DATA_PIPELINE_LOG'
+# Log destination used when the environment variable is not set: the Downloads folder of the Windows setup, and
+# the working directory elsewhere, where a Windows path would become a file named after it
+DEFAULT_LOG_DESTINATION = 'C:\\Downloads\\data_pipeline.log' if os.name == 'nt' else 'data_pipeline.log'
+LOG_FORMAT = '%(asctime)s:%(levelname)s:%(name)s:%(message)s'
+# Upper bounds on the rows, columns and characters rendered for a DataFrame in the log
+SUMMARY_MAX_ROWS = 5
+SUMMARY_MAX_COLUMNS = 20
+SUMMARY_MAX_CHARS = 4000
+
+
+class FrameSummary:
+    """
+    A size-capped, lazily rendered summary of a DataFrame, Series or pyarrow Table for use as a logging argument.
+
+    The shape and the first rows are captured when the summary is created, which is cheap and keeps later changes to
+    the frame out of the log. The text is only rendered if a handler formats the record, on the logging thread.
+
+    Attributes:
+        _shape (tuple): The shape of the summarised frame.
+        _head (pandas.DataFrame, pandas.Series or pyarrow.Table): A copy of the first rows and columns of the frame,
+            or a zero-copy slice of a Table.
+        _max_chars (int): The upper bound on the length of the rendered text.
+
+    Methods:
+        __str__: Renders the summary.
+    """
+    def __init__(self, frame, max_rows=SUMMARY_MAX_ROWS, max_columns=SUMMARY_MAX_COLUMNS,
+                 max_chars=SUMMARY_MAX_CHARS):
+        self._shape = frame.shape
+        if isinstance(frame, pa.Table):
+            self._head = frame.slice(0, max_rows).select(list(range(min(max_columns, frame.num_columns))))
+            self._max_chars = max_chars
+            return
+        head = frame.head(max_rows)
+        if head.ndim == 2:
+            head = head.iloc[:, :max_columns]
+        self._head = head.copy()
+        self._max_chars = max_chars
+
+    def __str__(self):
+        """
+        Renders the shape of the frame followed by its first rows.
+
+        Returns:
+            str: The summary, truncated to max_chars characters.
+        """
+        head = self._head.to_pandas() if isinstance(self._head, pa.Table) else self._head
+        text = 'shape=%s\n%s' % (self._shape, head.to_string())
+        if len(text) > self._max_chars:
+            text = text[:self._max_chars] + '...'
+        return text
+
+
+def summarize(frame, max_rows=SUMMARY_MAX_ROWS):
+    """
+    Returns a lazily rendered summary of a DataFrame or Series, e.g. logging.info('Result:\n%s', summarize(df)).
+
+    Args:
+        frame (pandas.DataFrame, pandas.Series or pyarrow.Table): The frame to summarise.
+        max_rows (int): The number of rows rendered.
+
+    Returns:
+        FrameSummary: The summary.
+    """
+    return FrameSummary(frame, max_rows)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    A queue handler that enqueues records unformatted.
+
+    logging.handlers.QueueHandler formats the message in the calling thread so that records can be pickled. The
+    listener runs in the same process, so the record is passed as is and the message is only formatted on the
+    listener thread.
+
+    Methods:
+        prepare: Returns the record unchanged.
+    """
+    def prepare(self, record):
+        """
+        Returns the record unchanged, leaving the formatting to the listener thread.
+
+        Args:
+            record (logging.LogRecord): The record to enqueue.
+
+        Returns:
+            logging.LogRecord: The same record.
+        """
+        return record
+
+
+class IdempotentQueueListener(logging.handlers.QueueListener):
+    """
+    A queue listener that can be stopped more than once, e.g. explicitly and again when the interpreter exits.
+
+    Methods:
+        stop: Flushes the queue and stops the listener thread if it is running.
+    """
+    def stop(self):
+        """
+        Flushes the queue and stops the listener thread if it is running.
+
+        Returns:
+            None
+        """
+        if self._thread is not None:
+            super().stop()
+
+
+def configure_logging(destination=None, level=logging.INFO, fmt=LOG_FORMAT):
+    """
+    Routes the root logger through a queue to a file or standard error written on a background thread.
+
+    Calling it again replaces the previous configuration.
+
+    Args:
+        destination (str or None): The log file path, '-' for standard error, or None to use the DATA_PIPELINE_LOG
+            environment variable and then the default path.
+        level (int): The level of the root logger.
+        fmt (str): The format of the log lines.
+
+    Returns:
+        IdempotentQueueListener: The running listener, also stopped when the interpreter exits.
+    """
+    if destination is None:
+        destination = os.environ.get(LOG_DESTINATION_ENV, DEFAULT_LOG_DESTINATION)
+    if destination == '-':
+        target = logging.StreamHandler(sys.stderr)
+    else:
+        target = logging.FileHandler(destination)
+    target.setFormatter(logging.Formatter(fmt))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, DeferredQueueHandler):
+            handler.listener.stop()
+            handler.listener.handlers[0].close()
+            atexit.unregister(handler.listener.stop)
+        root.removeHandler(handler)
+
+    log_queue = queue.SimpleQueue()
+    listener = IdempotentQueueListener(log_queue, target, respect_handler_level=True)
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.listener = listener
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,217 @@
+import contextlib
+import json
+import os
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    # The resource module is not available on Windows
+    resource = None
+
+
+def peak_rss_bytes():
+    """
+    Returns the peak resident set size of the current process, i.e. the highest RSS it reached since it started.
+
+    Returns:
+        int or None: The peak RSS in bytes, or None when the platform does not report it.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+
+class PipelineMetrics:
+    """
+    A collector of per-stage performance metrics for the data pipeline.
+
+    Every stage records its wall time, the CPU time of the process, the process_peak_rss_bytes high-water mark of
+    the process at the end of the stage and, when known, the number of rows and bytes it handled. The high-water
+    mark never goes down, so it only tells which stage first raised it. Named counters record events such as cache
+    hits.
+
+    Attributes:
+        _stages (list): The recorded stages, in completion order.
+        _counters (dict): The value of every counter.
+        _lock (threading.Lock): Protects _stages and _counters from stages running on different threads.
+
+    Methods:
+        stage: A context manager measuring one stage.
+        increment: Increments a counter.
+        counters: Returns the value of every counter.
+        to_dict: Returns the recorded stages.
+        to_json: Exports the recorded stages as JSON.
+        to_prometheus: Exports the recorded stages as a Prometheus textfile.
+    """
+    def __init__(self):
+        self._stages = []
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name, rows=None, nbytes=None):
+        """
+        Measures the stage run inside the with block.
+
+        The yielded record can be updated inside the block, e.g. record['rows'] = len(data).
+
+        Args:
+            name (str): The name of the stage.
+            rows (int or None): The number of rows handled by the stage, if already known.
+            nbytes (int or None): The number of bytes handled by the stage, if already known.
+
+        Yields:
+            dict: The record of the stage.
+        """
+        record = {'stage': name, 'rows': rows, 'bytes': nbytes}
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield record
+        finally:
+            record['wall_seconds'] = time.perf_counter() - start_wall
+            record['cpu_seconds'] = time.process_time() - start_cpu
+            record['process_peak_rss_bytes'] = peak_rss_bytes()
+            with self._lock:
+                self._stages.append(record)
+
+    def increment(self, name, value=1):
+        """
+        Increments a counter.
+
+        Args:
+            name (str): The name of the counter, e.g. 'result_cache_hits'.
+            value (int): The amount to add.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def counters(self):
+        """
+        Returns the value of every counter.
+
+        Returns:
+            dict: The value of every counter, by name.
+        """
+        with self._lock:
+            return dict(self._counters)
+
+    def to_dict(self):
+        """
+        Returns the recorded stages.
+
+        Returns:
+            list: One dictionary per recorded stage.
+        """
+        with self._lock:
+            return [dict(record) for record in self._stages]
+
+    def to_json(self, path):
+        """
+        Exports the recorded stages as a JSON file.
+
+        Args:
+            path (str): The path to the JSON file.
+
+        Returns:
+            None
+        """
+        self._write_atomic(path, json.dumps({'stages': self.to_dict(), 'counters': self.counters()}, indent=2))
+
+    def to_prometheus(self, path, prefix='data_pipeline'):
+        """
+        Exports the recorded stages in the Prometheus text format, e.g. for the node_exporter textfile collector.
+
+        A stage recorded more than once, e.g. one download per dataset, is exported as a single series: its wall
+        time, CPU time, rows and bytes are summed, the high-water mark is the largest one, and the runs gauge
+        tells how many records were merged.
+
+        Args:
+            path (str): The path to the .prom file.
+            prefix (str): The prefix of the metric names.
+
+        Returns:
+            None
+        """
+        metrics = [('wall_seconds', 'gauge', 'Wall time of the stage in seconds.'),
+                   ('cpu_seconds', 'gauge', 'Process CPU time spent during the stage in seconds.'),
+                   ('process_peak_rss_bytes', 'gauge',
+                    'Highest resident set size the process reached up to the end of the stage.'),
+                   ('rows', 'gauge', 'Number of rows handled by the stage.'),
+                   ('bytes', 'gauge', 'Number of bytes handled by the stage.'),
+                   ('runs', 'gauge', 'Number of times the stage ran.')]
+        stages = self._merged_stages()
+        lines = []
+        for key, metric_type, description in metrics:
+            name = '%s_stage_%s' % (prefix, key)
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s %s' % (name, metric_type))
+            for record in stages:
+                if record.get(key) is not None:
+                    label = record['stage'].replace('\\', '\\\\').replace('"', '\\"')
+                    lines.append('%s{stage="%s"} %s' % (name, label, repr(float(record[key]))))
+        for counter, value in sorted(self.counters().items()):
+            name = '%s_%s_total' % (prefix, counter)
+            lines.append('# TYPE %s counter' % name)
+            lines.append('%s %s' % (name, repr(float(value))))
+        self._write_atomic(path, '\n'.join(lines) + '\n')
+
+    def _merged_stages(self):
+        """
+        Merges the records of every stage name into one.
+
+        Returns:
+            list: One record per stage name, in order of first completion, with the number of merged records
+            under 'runs'.
+        """
+        merged = {}
+        for record in self.to_dict():
+            total = merged.get(record['stage'])
+            if total is None:
+                merged[record['stage']] = dict(record, runs=1)
+                continue
+            total['runs'] += 1
+            for key in ('wall_seconds', 'cpu_seconds', 'rows', 'bytes'):
+                if record.get(key) is not None:
+                    total[key] = (total.get(key) or 0) + record[key]
+            if record.get('process_peak_rss_bytes') is not None:
+                total['process_peak_rss_bytes'] = max(total.get('process_peak_rss_bytes') or 0,
+                                                      record['process_peak_rss_bytes'])
+        return list(merged.values())
+
+    def _write_atomic(self, path, text):
+        """
+        Writes a text file through a temporary file renamed into place.
+
+        Args:
+            path (str): The path to the file.
+            text (str): The content of the file.
+        """
+        with open(path + '.tmp', 'w', encoding='utf-8') as fwrite:
+            fwrite.write(text)
+        os.replace(path + '.tmp', path)
+
+
+def measure(metrics, name, rows=None, nbytes=None):
+    """
+    Measures a stage when a metrics collector is given, and does nothing otherwise.
+
+    Args:
+        metrics (PipelineMetrics or None): The metrics collector.
+        name (str): The name of the stage.
+        rows (int or None): The number of rows handled by the stage, if already known.
+        nbytes (int or None): The number of bytes handled by the stage, if already known.
+
+    Returns:
+        A context manager yielding the record of the stage, a throwaway dict when metrics is None.
+    """
+    if metrics is None:
+        return contextlib.nullcontext({})
+    return metrics.stage(name, rows, nbytes)
@@ -1,15 +1,48 @@
+import hashlib
+import json
 import os
+import shutil
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 import time
 import requests
 import logging
-from data_validation import DataValidator
-from data_transformation import DataTransformation
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from data_archive import ArchiveWriter, archive_codec, open_archive
+from data_cache import DownloadCache, ResultCache, content_hash
+from data_logging import configure_logging, summarize
+from data_metrics import PipelineMetrics, measure
+from data_validation import DataValidator, COMPACT_COLUMN_TYPES
+from data_transformation import DataTransformation, FILTER_PATTERN
 
 _logger = logging.getLogger("logger_name")
-logging.basicConfig(filename='C:\\Downloads\\data_pipeline.log',
-                    level=logging.DEBUG,
-                    format='%(asctime)s:%(levelname)s:%(name)s:%(message)s')
+
+# Size of each block read from the socket and written to disk when streaming a download
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# Number of bytes between two progress log lines when streaming a download
+DOWNLOAD_PROGRESS_INTERVAL = 64 * 1024 * 1024
+# Arrow type used at parse time for each compact pandas dtype
+ARROW_COMPACT_TYPES = {'category': pa.dictionary(pa.int32(), pa.string()), 'int16': pa.int16(),
+                       'int32': pa.int32(), 'float32': pa.float32()}
+# Number of rows of a Table formatted at a time when it is written to CSV
+CSV_BATCH_ROWS = 64 * 1024
+# Number of times a byte range is requested again after a dropped connection
+DOWNLOAD_MAX_RETRIES = 3
+# Schema metadata key holding the hash of the raw data an Arrow store was parsed from
+ARROW_SOURCE_HASH_KEY = b'source_hash'
+# Version of the content of the pipeline outputs, part of the result cache key. Bump it whenever a change to
+# DataTransformation or to the writers changes what the outputs of an unchanged input look like.
+# 2: results1 carries the year_group column.
+RESULTS_VERSION = 2
+# URL of the CSV export of a PxStat dataset, formatted with the dataset ID
+PXSTAT_DATASET_URL = 'https://ws.cso.ie/public/api.restful/PxStat.Data.Cube_API.ReadDataset/{}/CSV/1.0/en'
 
 
 class DataPipeline:
@@ -17,19 +50,52 @@ class DataPipeline:
         A data pipeline for downloading, transforming, and saving data.
 
         Attributes:
-            None
+            _cache (DownloadCache or None): The conditional-request download cache, or None to always download.
+            _metrics (PipelineMetrics or None): The collector of per-stage metrics, or None to skip measuring.
 
         Methods:
             __init__: Initializes the DataPipeline object.
             download_csv_data: Downloads data from a given URL .
+            download_csv_bytes: Downloads the undecoded bytes from a given URL.
+            iter_csv_chunks: Yields the undecoded bytes from a given URL one chunk at a time.
+            fetch_datasets: Downloads several datasets concurrently over a shared connection pool.
+            stream_csv_data: Streams data from a given URL straight into a file.
             convert_to_dataframe: Converts raw data into a pandas DataFrame.
+            load_raw_data: Parses raw bytes in memory while optionally archiving them to disk.
+            memory_report: Reports the memory used by each column of a DataFrame.
             save_raw_text: Saves raw data to a file.
             save_data_to_csv: Saves a DataFrame to a CSV file.
             save_data_to_parquet: Saves a DataFrame to a Parquet file.
+            save_data_to_parquet_dataset: Saves a DataFrame to a partitioned, tuned Parquet dataset.
+            save_data_atomic: Saves a DataFrame through a temporary file renamed into place.
+            write_outputs: Saves several DataFrames concurrently.
+            restore_outputs: Copies stored outputs back into place.
+            load_state: Loads the state of the previous incremental run.
+            save_state: Saves the state of an incremental run.
+            merge_filter_output: Merges the filtered rows of the changed years into a previous output.
     """
 
-    def __int__(self):
-        pass
+    def __init__(self, cache=None, metrics=None):
+        self._cache = cache
+        self._metrics = metrics
+
+    def _request(self, data_url, session=None, **kwargs):
+        """
+        Sends a GET request, made conditional on the cached ETag/Last-Modified values when a cache is set.
+
+        Args:
+            data_url (str): The URL of the CSV file.
+            session (requests.Session or None): The session to send the request with, or None for requests.get.
+            **kwargs: Extra keyword arguments passed to requests.get.
+
+        Returns:
+            requests.Response: The response.
+        """
+        if self._cache is not None:
+            headers = self._cache.conditional_headers(data_url)
+            if headers:
+                kwargs['headers'] = headers
+        return (session if session is not None else requests).get(data_url, **kwargs)
 
     def download_csv_data(self, data_url=''):
         """
@@ -41,67 +107,841 @@ class DataPipeline:
         Returns:
             The content of the CSV file.
         """
-        response = requests.get(data_url)
-        return response.content.decode('utf-8')
+        return self.download_csv_bytes(data_url).decode('utf-8')
+
+    def download_csv_bytes(self, data_url='', session=None):
+        """
+        Downloads data from the given URL without decoding it.
+
+        When a download cache is set, a 304 Not Modified answer is served from the cache and a fresh body is
+        stored in it.
+
+        Args:
+            data_url (str): The URL of the CSV file.
+            session (requests.Session or None): The session to download with, or None for requests.get.
+
+        Returns:
+            bytes: The raw content of the CSV file.
+        """
+        with measure(self._metrics, 'download') as record:
+            content = self._download_bytes(data_url, session)
+            record['bytes'] = len(content)
+        return content
+
+    def _download_bytes(self, data_url, session):
+        """
+        Downloads data from the given URL without decoding it, going through the download cache when set.
+
+        Args:
+            data_url (str): The URL of the CSV file.
+            session (requests.Session or None): The session to download with, or None for requests.get.
+
+        Returns:
+            bytes: The raw content of the CSV file.
+        """
+        response = self._request(data_url, session)
+        if response.status_code == 304 and self._cache is not None:
+            content = self._cache.load(data_url)
+            if content is not None:
+                logging.info('Dataset not modified, served from the download cache: %s', data_url)
+                return content
+            response = (session if session is not None else requests).get(data_url)
+        response.raise_for_status()
+        if self._cache is not None:
+            self._cache.store(data_url, response.content, response.headers)
+        return response.content
+
+    def iter_csv_chunks(self, data_url, chunk_size=DOWNLOAD_CHUNK_SIZE):
+        """
+        Yields the raw content of the given URL one chunk at a time, without holding the whole file in memory.
+
+        When a download cache is set, a 304 Not Modified answer is served from the cache, and a 304 whose body is
+        no longer cached falls back to one unconditional request.
+
+        Args:
+            data_url (str): The URL of the CSV file.
+            chunk_size (int): The number of bytes per chunk.
+
+        Yields:
+            bytes: The next chunk of the raw content.
+        """
+        response = self._request(data_url, stream=True)
+        if response.status_code == 304 and self._cache is not None:
+            response.close()
+            content = self._cache.load(data_url)
+            if content is not None:
+                logging.info('Dataset not modified, served from the download cache: %s', data_url)
+                for start in range(0, len(content), chunk_size):
+                    yield content[start:start + chunk_size]
+                return
+            response = requests.get(data_url, stream=True)
+        with response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    yield chunk
+
+    def dataset_url(self, dataset):
+        """
+        Returns the CSV export URL of a PxStat dataset.
+
+        Args:
+            dataset (str): A PxStat dataset ID such as 'EDA14', or a full URL which is returned unchanged.
+
+        Returns:
+            str: The URL of the CSV file.
+        """
+        if '://' in dataset:
+            return dataset
+        return PXSTAT_DATASET_URL.format(dataset)
+
+    def fetch_datasets(self, datasets, max_workers=8, per_host_limit=4):
+        """
+        Downloads several datasets concurrently over a shared, pooled requests.Session.
+
+        A bounded thread pool runs the downloads and a semaphore per host caps how many of them hit the same
+        server at once. Results are yielded as each download finishes, not in input order.
+
+        Args:
+            datasets (list): PxStat dataset IDs or URLs of the CSV files.
+            max_workers (int): The maximum number of downloads running at once.
+            per_host_limit (int): The maximum number of downloads running at once against a single host.
+
+        Yields:
+            Tuple[str, bytes]: The dataset ID or URL as given, and the raw content of its CSV file.
+        """
+        urls = {dataset: self.dataset_url(dataset) for dataset in datasets}
+        host_slots = {urlsplit(url).netloc: threading.BoundedSemaphore(per_host_limit) for url in urls.values()}
+        adapter = HTTPAdapter(pool_connections=len(host_slots) or 1, pool_maxsize=max_workers)
+
+        def fetch(url, session):
+            with host_slots[urlsplit(url).netloc]:
+                return self.download_csv_bytes(url, session)
+
+        with requests.Session() as session, ThreadPoolExecutor(max_workers=max_workers) as executor:
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            futures = {executor.submit(fetch, url, session): dataset for dataset, url in urls.items()}
+            for future in as_completed(futures):
+                logging.info('Downloaded dataset %s', futures[future])
+                yield futures[future], future.result()
+
+    def stream_csv_data(self, data_url, destination_folder, chunk_size=DOWNLOAD_CHUNK_SIZE):
+        """
+        Streams data from the given URL straight into a file, one chunk at a time.
+
+        Only one chunk is held in memory at any point, so memory use stays flat regardless of the
+        size of the dataset. Progress (bytes received and throughput) is logged as the download goes.
+        When a download cache is set, a 304 Not Modified answer is copied from the cache. A destination ending
+        in .zst, .gz or .lz4 is compressed chunk by chunk as the download goes, and bypasses the download cache.
+
+        Args:
+            data_url (str): The URL of the CSV file.
+            destination_folder (str): The path to the destination file.
+            chunk_size (int): The number of bytes read and written per chunk.
+
+        Returns:
+            int: The number of bytes received, before compression.
+        """
+        with measure(self._metrics, 'download') as record:
+            record['bytes'] = self._stream_to_file(data_url, destination_folder, chunk_size)
+        return record['bytes']
+
+    def _stream_to_file(self, data_url, destination_folder, chunk_size):
+        """
+        Streams data from the given URL into a file, going through the download cache when set.
+
+        Args:
+            data_url (str): The URL of the CSV file.
+            destination_folder (str): The path to the destination file.
+            chunk_size (int): The number of bytes read and written per chunk.
+
+        Returns:
+            int: The number of bytes written to the destination file.
+        """
+        start_time = time.perf_counter()
+        total_bytes = 0
+        next_report = DOWNLOAD_PROGRESS_INTERVAL
+        cache = self._cache if archive_codec(destination_folder) is None else None
+        if cache is None:
+            response = requests.get(data_url, stream=True)
+        else:
+            response = self._request(data_url, stream=True)
+            if response.status_code == 304:
+                response.close()
+                cached_bytes = cache.copy_to(data_url, destination_folder)
+                if cached_bytes is not None:
+                    logging.info('Dataset not modified, served from the download cache: %s', data_url)
+                    return cached_bytes
+                response = requests.get(data_url, stream=True)
+        with response:
+            response.raise_for_status()
+            with ArchiveWriter(destination_folder) as fwrite:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    if not chunk:
+                        continue
+                    fwrite.write(chunk)
+                    total_bytes += len(chunk)
+                    if total_bytes >= next_report:
+                        self._log_download_progress(total_bytes, start_time)
+                        next_report += DOWNLOAD_PROGRESS_INTERVAL
+            if cache is not None:
+                cache.store_file(data_url, destination_folder, response.headers)
+        self._log_download_progress(total_bytes, start_time)
+        return total_bytes
+
+    def download_resumable(self, data_url, destination_folder, parts=1, expected_sha256=None,
+                           chunk_size=DOWNLOAD_CHUNK_SIZE, max_retries=DOWNLOAD_MAX_RETRIES):
+        """
+        Downloads a file with HTTP Range requests, resuming partial downloads and optionally fetching byte ranges
+        in parallel.
+
+        Every byte range is streamed to its own destination.partN file. A dropped connection is retried from the
+        current size of the part, and parts left by an interrupted run are resumed as long as the ETag and length
+        of the file are unchanged. The parts are joined, the length and optionally the SHA-256 checksum are
+        verified, and only then is the file renamed to the destination. Servers that do not support ranges fall
+        back to a single streamed request.
+
+        Args:
+            data_url (str): The URL of the CSV file.
+            destination_folder (str): The path to the destination file.
+            parts (int): The number of byte ranges downloaded in parallel.
+            expected_sha256 (str or None): The expected hex SHA-256 checksum of the file, or None to only check
+                the length.
+            chunk_size (int): The number of bytes read and written per chunk.
+            max_retries (int): The number of times a byte range is requested again after a dropped connection.
+
+        Returns:
+            int: The number of bytes of the destination file.
+
+        Raises:
+            ValueError: If the downloaded file does not have the announced length or the expected checksum.
+        """
+        with measure(self._metrics, 'download') as record, requests.Session() as session:
+            # Byte ranges must index the stored file, not a body the server compresses on the fly
+            session.headers['Accept-Encoding'] = 'identity'
+            head = session.head(data_url, allow_redirects=True)
+            total_length = int(head.headers.get('Content-Length', -1)) if head.ok else -1
+            if not head.ok or head.headers.get('Accept-Ranges') != 'bytes' or total_length <= 0:
+                logging.info('Range requests not supported, downloading %s in one request', data_url)
+                parts, ranges = 1, [(0, None)]
+            else:
+                parts = max(1, min(parts, total_length // chunk_size or 1))
+                bounds = [total_length * part // parts for part in range(parts + 1)]
+                ranges = [(bounds[part], bounds[part + 1] - 1) for part in range(parts)]
+            part_paths = ['%s.part%d' % (destination_folder, part) for part in range(parts)]
+            self._check_partial_download(destination_folder, head.headers.get('ETag'), total_length, part_paths)
+
+            with ThreadPoolExecutor(max_workers=parts) as executor:
+                futures = [executor.submit(self._download_range, session, data_url, part_path, start, end,
+                                           chunk_size, max_retries)
+                           for part_path, (start, end) in zip(part_paths, ranges)]
+                for future in futures:
+                    future.result()
+            record['bytes'] = self._join_parts(destination_folder, part_paths, total_length, expected_sha256)
+        return record['bytes']
+
+    def _check_partial_download(self, destination_folder, etag, total_length, part_paths):
+        """
+        Removes the parts left by an interrupted download if the remote file changed since, and records the
+        validators of the file for the next run.
+
+        Args:
+            destination_folder (str): The path to the destination file.
+            etag (str or None): The ETag of the remote file.
+            total_length (int): The length of the remote file, or -1 if unknown.
+            part_paths (list): The paths of the part files.
+        """
+        meta_path = destination_folder + '.parts.json'
+        meta = {'etag': etag, 'length': total_length, 'parts': len(part_paths)}
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as fread:
+                previous_meta = json.load(fread)
+        except (OSError, ValueError):
+            previous_meta = None
+        if previous_meta != meta or etag is None:
+            for part_path in part_paths:
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+        with open(meta_path, 'w', encoding='utf-8') as fwrite:
+            json.dump(meta, fwrite)
+
+    def _download_range(self, session, data_url, part_path, start, end, chunk_size, max_retries):
+        """
+        Downloads one byte range into a part file, resuming from the current size of the part after a dropped
+        connection.
+
+        Args:
+            session (requests.Session): The session to download with.
+            data_url (str): The URL of the CSV file.
+            part_path (str): The path of the part file.
+            start (int): The first byte of the range.
+            end (int or None): The last byte of the range, or None to download the whole file without a Range.
+            chunk_size (int): The number of bytes read and written per chunk.
+            max_retries (int): The number of times the range is requested again after a dropped connection.
+
+        Returns:
+            int: The number of bytes of the part file.
+        """
+        for attempt in range(max_retries + 1):
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            if end is not None and start + offset > end:
+                return offset
+            headers = {} if end is None else {'Range': 'bytes=%d-%d' % (start + offset, end)}
+            if end is None:
+                offset = 0
+            try:
+                with session.get(data_url, headers=headers, stream=True) as response:
+                    response.raise_for_status()
+                    if end is not None and response.status_code != 206:
+                        raise ValueError('The server ignored the Range header of %s' % data_url)
+                    with open(part_path, 'ab' if offset else 'wb') as fwrite:
+                        for chunk in response.iter_content(chunk_size=chunk_size):
+                            fwrite.write(chunk)
+                if end is None:
+                    return os.path.getsize(part_path)
+            except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+                if attempt == max_retries:
+                    raise
+                logging.info('Download of %s interrupted at byte %d, resuming :: %s', data_url,
+                             start + os.path.getsize(part_path), e)
+        return os.path.getsize(part_path)
+
+    def _join_parts(self, destination_folder, part_paths, total_length, expected_sha256):
+        """
+        Joins the part files, verifies the result and renames it to the destination.
+
+        Args:
+            destination_folder (str): The path to the destination file.
+            part_paths (list): The paths of the part files, in order.
+            total_length (int): The announced length of the file, or -1 if unknown.
+            expected_sha256 (str or None): The expected hex SHA-256 checksum, or None to skip the check.
+
+        Returns:
+            int: The number of bytes of the destination file.
+
+        Raises:
+            ValueError: If the file does not have the announced length or the expected checksum.
+        """
+        tmp_path = destination_folder + '.tmp'
+        digest = hashlib.sha256()
+        total_bytes = 0
+        with open(tmp_path, 'wb') as fwrite:
+            for part_path in part_paths:
+                with open(part_path, 'rb') as fread:
+                    for block in iter(lambda: fread.read(DOWNLOAD_CHUNK_SIZE), b''):
+                        digest.update(block)
+                        fwrite.write(block)
+                        total_bytes += len(block)
+        for part_path in part_paths:
+            os.remove(part_path)
+        os.remove(destination_folder + '.parts.json')
+        if total_length >= 0 and total_bytes != total_length:
+            os.remove(tmp_path)
+            raise ValueError('Downloaded %d bytes instead of %d' % (total_bytes, total_length))
+        if expected_sha256 is not None and digest.hexdigest() != expected_sha256:
+            os.remove(tmp_path)
+            raise ValueError('The checksum of the download does not match %s' % expected_sha256)
+        os.replace(tmp_path, destination_folder)
+        return total_bytes
+
+    def _log_download_progress(self, total_bytes, start_time):
+        """
+        Logs the number of bytes downloaded so far and the average throughput.
 
-    def convert_to_dataframe(self, raw_data):
+        Args:
+            total_bytes (int): The number of bytes downloaded so far.
+            start_time (float): The time.perf_counter() value at the start of the download.
+        """
+        elapsed = max(time.perf_counter() - start_time, 1e-9)
+        logging.info('Downloaded %d bytes (%.2f MB/s)', total_bytes, total_bytes / elapsed / (1024 * 1024))
+
+    def convert_to_dataframe(self, raw_data, compact=False):
         """
-        Converts raw data into a pandas DataFrame.
+        Converts raw data into a pandas DataFrame using the pyarrow CSV engine.
+
+        Bytes-like input is wrapped in a pyarrow.BufferReader, so it is parsed in memory without being copied
+        or written to disk first. zstd, gzip and lz4 raw archives, recognised by their extension or their magic
+        bytes, are decompressed on the fly while they are parsed. In compact mode the columns listed in
+        COMPACT_COLUMN_TYPES are parsed straight into categorical, int16/int32 and float32 columns.
 
         Args:
-            raw_data (str): The raw data in CSV format.
+            raw_data (str, bytes, bytearray, memoryview or file-like): The path to a CSV file or raw archive, the
+                raw CSV or archive content, or a readable binary buffer.
+            compact (bool): Whether to parse the known columns into compact dtypes.
 
         Returns:
             pandas.DataFrame: The data as a DataFrame.
         """
-        data_frame = pd.read_csv(raw_data, sep=',', header=0, encoding='utf-8')
+        with measure(self._metrics, 'parse') as record:
+            if isinstance(raw_data, (bytes, bytearray, memoryview)):
+                record['bytes'] = len(raw_data)
+            if isinstance(raw_data, (str, bytes, bytearray, memoryview)):
+                raw_data = open_archive(raw_data)
+            if compact:
+                data_frame = self._read_csv_table(raw_data, compact).to_pandas()
+            else:
+                data_frame = pd.read_csv(raw_data, sep=',', header=0, encoding='utf-8', engine='pyarrow')
+            record['rows'] = len(data_frame)
         return data_frame
 
-    def save_raw_text(self, destination_folder, raw_data):
+    def convert_to_table(self, raw_data, compact=False):
         """
-        Saves raw data to a file.
+        Converts raw data into a pyarrow Table with the multithreaded pyarrow CSV reader, without pandas.
+
+        Args:
+            raw_data (str, bytes, bytearray, memoryview or file-like): The path to a CSV file or raw archive, the
+                raw CSV or archive content, or a readable binary buffer.
+            compact (bool): Whether to parse the known columns into dictionary-encoded and narrow numeric types.
+
+        Returns:
+            pyarrow.Table: The data as a Table.
+        """
+        with measure(self._metrics, 'parse') as record:
+            if isinstance(raw_data, (bytes, bytearray, memoryview)):
+                record['bytes'] = len(raw_data)
+            if isinstance(raw_data, (str, bytes, bytearray, memoryview)):
+                raw_data = open_archive(raw_data)
+            table = self._read_csv_table(raw_data, compact)
+            record['rows'] = table.num_rows
+        return table
+
+    def _read_csv_table(self, source, compact):
+        """
+        Reads CSV data with the pyarrow CSV reader.
+
+        Args:
+            source (str or pyarrow.NativeFile): The path to a CSV file or a readable stream.
+            compact (bool): Whether to parse the columns listed in COMPACT_COLUMN_TYPES into compact types.
+
+        Returns:
+            pyarrow.Table: The data as a Table.
+        """
+        column_types = {}
+        if compact:
+            column_types = {column: ARROW_COMPACT_TYPES[dtype] for column, dtype in COMPACT_COLUMN_TYPES.items()}
+        return pa_csv.read_csv(source, convert_options=pa_csv.ConvertOptions(column_types=column_types))
+
+    def load_raw_data(self, raw_data, destination_folder=None, compact=False, arrow_path=None, as_table=False):
+        """
+        Parses raw CSV bytes in memory, archiving them to disk concurrently when a destination is given.
+
+        When an Arrow store path is given, the parsed frame is reloaded from the store if it was parsed from the
+        same raw data with the same settings, and the store is written after parsing otherwise. Only a reload with
+        as_table=True is zero-copy: the Table references the memory-mapped file. A DataFrame is converted from the
+        mapped Table into private memory, which is cheaper than parsing but copies the whole data.
+
+        Args:
+            raw_data (bytes): The raw data in CSV format.
+            destination_folder (str or None): The path of the raw archive file, or None to skip archiving.
+            compact (bool): Whether to parse the known columns into compact dtypes.
+            arrow_path (str or None): The path of the Arrow IPC store of the parsed frame, or None to always parse.
+            as_table (bool): Whether to return a pyarrow Table, never converted to pandas, for the Arrow backend.
+
+        Returns:
+            pandas.DataFrame or pyarrow.Table: The data as a DataFrame, or as a Table if as_table is True.
+        """
+        if destination_folder is None:
+            return self._parse_or_reload(raw_data, compact, arrow_path, as_table)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            archived = executor.submit(self.save_raw_text, destination_folder, raw_data)
+            data_frame = self._parse_or_reload(raw_data, compact, arrow_path, as_table)
+            if not archived.result():
+                raise Exception('File Cannot be written.')
+        return data_frame
+
+    def _parse_or_reload(self, raw_data, compact, arrow_path, as_table=False):
+        """
+        Reloads the parsed frame from a valid Arrow store, or parses the raw data and refreshes the store.
+
+        The reload of a DataFrame is measured as the arrow_to_pandas stage, apart from the arrow_load stage that
+        only maps the file.
+
+        Args:
+            raw_data (bytes): The raw data in CSV format.
+            compact (bool): Whether to parse the known columns into compact dtypes.
+            arrow_path (str or None): The path of the Arrow IPC store, or None to always parse.
+            as_table (bool): Whether to return a pyarrow Table instead of a DataFrame.
+
+        Returns:
+            pandas.DataFrame or pyarrow.Table: The parsed data.
+        """
+        parse = self.convert_to_table if as_table else self.convert_to_dataframe
+        if arrow_path is None:
+            return parse(raw_data, compact)
+        source_hash = content_hash(raw_data, {'compact': compact})
+        table = self.open_arrow_store(arrow_path, source_hash)
+        if table is not None:
+            logging.info('Reloaded the parsed data from the Arrow store %s', arrow_path)
+            if as_table:
+                return table
+            with measure(self._metrics, 'arrow_to_pandas', table.num_rows, table.nbytes):
+                return table.to_pandas(split_blocks=True)
+        data_frame = parse(raw_data, compact)
+        self.save_arrow_store(data_frame, arrow_path, source_hash)
+        return data_frame
+
+    def save_arrow_store(self, data, path, source_hash=None):
+        """
+        Writes a parsed frame to an uncompressed Arrow IPC (Feather v2) file that can be memory-mapped.
+
+        The file is written to a temporary path and renamed into place, and the hash of the raw data it was parsed
+        from is kept in the schema metadata.
+
+        Args:
+            data (pandas.DataFrame or pyarrow.Table): The parsed data.
+            path (str): The path of the Arrow IPC file.
+            source_hash (str or None): The content_hash of the raw data and parse settings.
+
+        Returns:
+            None
+        """
+        table = data if isinstance(data, pa.Table) else pa.Table.from_pandas(data, preserve_index=False)
+        metadata = dict(table.schema.metadata or {})
+        if source_hash is not None:
+            metadata[ARROW_SOURCE_HASH_KEY] = source_hash.encode('utf-8')
+        table = table.replace_schema_metadata(metadata)
+        with measure(self._metrics, 'arrow_store', table.num_rows, table.nbytes):
+            with pa.OSFile(path + '.tmp', 'wb') as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            os.replace(path + '.tmp', path)
+
+    def open_arrow_store(self, path, source_hash=None):
+        """
+        Memory-maps an Arrow IPC store without copying it.
+
+        The returned table references the pages of the file, so opening it takes no private memory for the data;
+        pages are read on first access and shared with other processes mapping the same file.
+
+        Args:
+            path (str): The path of the Arrow IPC file.
+            source_hash (str or None): The expected content_hash of the raw data, or None to skip the check.
+
+        Returns:
+            pyarrow.Table or None: The memory-mapped table, or None if the file is missing, unreadable or stale.
+        """
+        with measure(self._metrics, 'arrow_load') as record:
+            try:
+                reader = pa.ipc.open_file(pa.memory_map(path, 'r'))
+            except (OSError, pa.ArrowInvalid):
+                return None
+            stored_hash = (reader.schema.metadata or {}).get(ARROW_SOURCE_HASH_KEY)
+            if source_hash is not None and stored_hash != source_hash.encode('utf-8'):
+                logging.info('Stale Arrow store %s, the raw data changed', path)
+                return None
+            table = reader.read_all()
+            record['rows'] = table.num_rows
+        return table
+
+    def memory_report(self, data):
+        """
+        Reports the dtype and the memory used by each column of the DataFrame, strings included.
+
+        Args:
+            data (pandas.DataFrame): The DataFrame to measure.
+
+        Returns:
+            pandas.DataFrame: One row per column with its 'dtype' and 'bytes', plus a 'total' row.
+        """
+        memory = data.memory_usage(index=False, deep=True)
+        report = pd.DataFrame({'dtype': data.dtypes.astype(str), 'bytes': memory})
+        report.loc['total'] = ['', int(memory.sum())]
+        logging.info('DataFrame memory usage: %d bytes', memory.sum())
+        return report
+
+    def save_raw_text(self, destination_folder, raw_data, codec=None):
+        """
+        Saves raw data to a file, compressed when the destination ends in .zst, .gz or .lz4 or a codec is given.
+
+        Compression is streamed one chunk at a time, so no compressed copy of the whole data is built in memory.
 
         Args:
             destination_folder (str): The path to the destination file.
-            raw_data (str): The raw data to be saved.
+            raw_data (str or bytes): The raw data to be saved.
+            codec (str or None): 'zstd', 'gzip' or 'lz4', or None to use the extension of the destination.
 
         Returns:
             bool: True if the data was successfully saved, False otherwise.
         """
         try:
-            with open(destination_folder, 'w+', encoding='utf-8') as fwrite:
-                fwrite.write(raw_data)
+            with measure(self._metrics, 'raw_save', nbytes=len(raw_data)):
+                if isinstance(raw_data, (bytes, bytearray, memoryview)):
+                    raw_view = memoryview(raw_data)
+                    with ArchiveWriter(destination_folder, codec) as fwrite:
+                        for start in range(0, len(raw_view), DOWNLOAD_CHUNK_SIZE):
+                            fwrite.write(raw_view[start:start + DOWNLOAD_CHUNK_SIZE])
+                elif codec is not None or archive_codec(destination_folder) is not None:
+                    return self.save_raw_text(destination_folder, raw_data.encode('utf-8'), codec)
+                else:
+                    with open(destination_folder, 'w+', encoding='utf-8') as fwrite:
+                        fwrite.write(raw_data)
             return True
         except Exception as e:
-            logging.info('Cannot write to this file ::')
-            logging.info(e)
+            logging.info('Cannot write to this file :: %s', e)
             return False
 
     def save_data_to_csv(self, data, csvdata):
         """
         Saves the DataFrame to a CSV file.
 
+        A named index, such as the year_group of the aggregated data, is written as a column, as the key column of
+        the same data in a Table is.
+
         Args:
-            data (pandas.DataFrame): The DataFrame to be saved.
+            data (pandas.DataFrame or pyarrow.Table): The DataFrame to be saved. Tables are formatted by pandas one
+                record batch at a time, so both backends write the same file.
             csvdata (str): The path to the output CSV file.
 
         Returns:
             None
         """
-        data.to_csv(csvdata, index=False)
+        if isinstance(data, pa.Table):
+            # pyarrow's CSV writer quotes every string and writes 24812.0 as 24812, unlike DataFrame.to_csv
+            batches = data.to_batches(max_chunksize=CSV_BATCH_ROWS) or [data.schema.empty_table()]
+            with open(csvdata, 'w', encoding='utf-8', newline='') as fwrite:
+                for number, batch in enumerate(batches):
+                    batch.to_pandas().to_csv(fwrite, index=False, header=number == 0)
+            return
+        self._with_index_columns(data).to_csv(csvdata, index=False)
 
     def save_data_to_parquet(self, data, parquetdata):
         """
-        Saves the DataFrame to a Parquet file.
+        Saves the DataFrame to a Parquet file, writing a named index as a column like save_data_to_csv.
 
         Args:
-            data (pandas.DataFrame): The DataFrame to be saved.
+            data (pandas.DataFrame or pyarrow.Table): The DataFrame to be saved. Tables are written with
+                pyarrow.parquet.write_table without conversion.
             parquetdata (str): The path to the output Parquet file.
 
         Returns:
             None
         """
-        data.to_parquet(parquetdata, index=False)
+        if isinstance(data, pa.Table):
+            pq.write_table(data, parquetdata)
+            return
+        self._with_index_columns(data).to_parquet(parquetdata, index=False)
+
+    def _with_index_columns(self, data):
+        """
+        Moves the named index levels of a DataFrame into columns.
+
+        Args:
+            data (pandas.DataFrame): The DataFrame.
+
+        Returns:
+            pandas.DataFrame: The DataFrame itself if its index is unnamed, a copy with the index reset otherwise.
+        """
+        if all(name is None for name in data.index.names):
+            return data
+        return data.reset_index()
+
+    def save_data_to_parquet_dataset(self, data, parquet_dataset, partition_cols=('year_group',),
+                                     compression='snappy', row_group_size=None, use_dictionary=True,
+                                     write_statistics=True, engine='pyarrow'):
+        """
+        Saves the DataFrame to a Hive-partitioned Parquet dataset (one 'column=value' directory per partition).
+
+        Column statistics are written so that readers can skip row groups and partitions by predicate, e.g.
+        pyarrow.parquet.read_table(path, filters=[('year_group', '>=', 2015)]). Partitions present in the new
+        data replace the same partitions of an existing dataset.
+
+        Args:
+            data (pandas.DataFrame or pyarrow.Table): The DataFrame to be saved. Index levels named in
+                partition_cols are used as partition columns.
+            parquet_dataset (str): The path to the root directory of the dataset.
+            partition_cols (list): The columns to partition on.
+            compression (str): The codec, e.g. 'snappy', 'zstd', 'gzip' or 'none'.
+            row_group_size (int or None): The maximum number of rows per row group, or None for the engine default.
+            use_dictionary (bool): Whether to dictionary-encode columns. With fastparquet, object columns are
+                written as categoricals to get dictionary pages.
+            write_statistics (bool): Whether to write min/max/null-count statistics.
+            engine (str): 'pyarrow' or 'fastparquet'.
+
+        Returns:
+            None
+        """
+        with measure(self._metrics, 'write:' + os.path.basename(os.path.normpath(parquet_dataset)), len(data)):
+            self._write_parquet_dataset(data, parquet_dataset, list(partition_cols), compression, row_group_size,
+                                        use_dictionary, write_statistics, engine)
+
+    def _write_parquet_dataset(self, data, parquet_dataset, partition_cols, compression, row_group_size,
+                               use_dictionary, write_statistics, engine):
+        """
+        Writes the partitioned Parquet dataset described in save_data_to_parquet_dataset.
+        """
+        if isinstance(data, pa.Table):
+            table = data
+            if engine == 'fastparquet':
+                data = table.to_pandas()
+        else:
+            if any(name in partition_cols for name in data.index.names):
+                data = data.reset_index()
+            table = pa.Table.from_pandas(data, preserve_index=False) if engine == 'pyarrow' else None
+        if engine == 'pyarrow':
+            file_options = ds.ParquetFileFormat().make_write_options(compression=compression,
+                                                                      use_dictionary=use_dictionary,
+                                                                      write_statistics=write_statistics)
+            ds.write_dataset(table, parquet_dataset, format='parquet', partitioning=partition_cols,
+                             partitioning_flavor='hive', file_options=file_options,
+                             max_rows_per_group=row_group_size, existing_data_behavior='delete_matching')
+        elif engine == 'fastparquet':
+            if use_dictionary:
+                data = data.astype({column: 'category' for column in data.select_dtypes('object').columns
+                                    if column not in partition_cols})
+            data.to_parquet(parquet_dataset, engine='fastparquet', index=False, partition_cols=partition_cols,
+                            compression=None if compression == 'none' else compression,
+                            row_group_offsets=row_group_size, stats=write_statistics)
+        else:
+            raise ValueError('Unsupported Parquet engine: ' + str(engine))
+
+    def save_data_atomic(self, data, data_format, path):
+        """
+        Saves the DataFrame to a temporary file in the destination directory and renames it into place.
+
+        Readers never see a partially written file: the destination either keeps its previous content or holds
+        the complete new one.
+
+        Args:
+            data (pandas.DataFrame or pyarrow.Table): The DataFrame to be saved.
+            data_format (str): 'csv' or 'parquet'.
+            path (str): The path to the output file.
+
+        Returns:
+            str: The path to the output file.
+        """
+        writers = {'csv': self.save_data_to_csv, 'parquet': self.save_data_to_parquet}
+        if data_format not in writers:
+            raise ValueError('Unsupported output format: ' + str(data_format))
+        with measure(self._metrics, 'write:' + os.path.basename(path), len(data)) as record:
+            self._replace_atomic(path, lambda tmp_path: writers[data_format](data, tmp_path))
+            record['bytes'] = os.path.getsize(path)
+        return path
+
+    def _replace_atomic(self, path, write):
+        """
+        Writes a file to a temporary path in the destination directory and renames it into place.
+
+        Args:
+            path (str): The path to the output file.
+            write (callable): Writes the content to the temporary path it is given.
+        """
+        directory, file_name = os.path.split(os.path.abspath(path))
+        # Created with open() rather than tempfile.mkstemp, whose 0600 mode would survive the rename
+        tmp_path = os.path.join(directory, '.%s.%s.tmp' % (file_name, uuid.uuid4().hex))
+        open(tmp_path, 'xb').close()
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def restore_outputs(self, stored, outputs):
+        """
+        Copies stored outputs, e.g. a ResultCache hit, back into place.
+
+        Files are restored through a temporary file renamed into place, like save_data_atomic. Directories are
+        copied next to the destination in full, then swapped in with two renames, so a reader never sees a
+        partially copied directory.
+
+        Args:
+            stored (dict): The path of every stored output file or directory, by name.
+            outputs (dict): The destination path of every output, by name.
+
+        Returns:
+            list: The paths of the restored outputs.
+        """
+        restored = []
+        for name, source in stored.items():
+            path = outputs[name]
+            if os.path.isdir(source):
+                directory, dir_name = os.path.split(os.path.abspath(path))
+                tmp_path = os.path.join(directory, '.%s.%s.tmp' % (dir_name, uuid.uuid4().hex))
+                shutil.copytree(source, tmp_path)
+                if os.path.exists(path):
+                    os.replace(path, tmp_path + '.old')
+                os.replace(tmp_path, path)
+                shutil.rmtree(tmp_path + '.old', ignore_errors=True)
+            else:
+                self._replace_atomic(path, lambda tmp_path: shutil.copyfile(source, tmp_path))
+            restored.append(path)
+        return restored
+
+    def write_outputs(self, targets, max_workers=None):
+        """
+        Saves several DataFrames concurrently on a thread pool, each one atomically.
+
+        Only the Parquet writes overlap: pyarrow releases the GIL while it encodes and compresses them. The CSV
+        writes are formatted by DataFrame.to_csv, which holds the GIL, so they run one after another and the total
+        time is about the sum of the CSV writes, overlapped with the slowest Parquet write.
+
+        Args:
+            targets (list): (data, data_format, path) tuples, data_format being 'csv' or 'parquet'.
+            max_workers (int or None): The maximum number of writes running at once, one per target by default.
+
+        Returns:
+            list: The paths of the written files, in the order of the targets.
+        """
+        targets = list(targets)
+        if not targets:
+            return []
+        with ThreadPoolExecutor(max_workers=max_workers or len(targets)) as executor:
+            futures = [executor.submit(self.save_data_atomic, data, data_format, path)
+                       for data, data_format, path in targets]
+            return [future.result() for future in futures]
+
+    def load_state(self, state_path):
+        """
+        Loads the state of the previous incremental run.
+
+        Args:
+            state_path (str): The path to the JSON state file.
+
+        Returns:
+            dict or None: The state, or None if no previous run left a state file.
+        """
+        if not os.path.exists(state_path):
+            return None
+        with open(state_path, 'r', encoding='utf-8') as fread:
+            return json.load(fread)
+
+    def save_state(self, state_path, state):
+        """
+        Saves the state of an incremental run, replacing the previous state file atomically.
+
+        Args:
+            state_path (str): The path to the JSON state file.
+            state (dict): The state returned by DataTransformation.data_transform_incremental.
+
+        Returns:
+            None
+        """
+        with open(state_path + '.tmp', 'w', encoding='utf-8') as fwrite:
+            json.dump(state, fwrite)
+        os.replace(state_path + '.tmp', state_path)
+
+    def merge_filter_output(self, filter_delta, changed_years, csvdata):
+        """
+        Merges the filtered rows of the changed years into the filtered output of the previous run.
+
+        Rows of the changed years are dropped from the previous output and replaced by filter_delta.
+
+        Args:
+            filter_delta (pandas.DataFrame): The filtered rows of the changed years.
+            changed_years (list): The years that were added, changed or removed since the previous run.
+            csvdata (str): The path to the filtered CSV output of the previous run.
+
+        Returns:
+            pandas.DataFrame: The merged filtered data.
+        """
+        if not os.path.exists(csvdata):
+            return filter_delta
+        previous = pd.read_csv(csvdata)
+        previous = previous[~previous['year'].isin(changed_years)]
+        return pd.concat([previous, filter_delta], ignore_index=True).sort_values('year', kind='stable',
+                                                                                 ignore_index=True)
 
 
 if __name__ == '__main__':
@@ -111,52 +951,114 @@ if __name__ == '__main__':
     # Define the URL, file names, and directories
     url = 'https://ws.cso.ie/public/api.restful/PxStat.Data.Cube_API.ReadDataset/EDA14/CSV/1.0/en'
     file_name = 'school_data.csv'
-    des_dir = 'C:\\Downloads\\' + file_name
+    # The raw archive is compressed with zstd, about 10x smaller than the CSV
+    des_dir = 'C:\\Downloads\\' + file_name + '.zst'
     csv_dir = 'C:\\Downloads\\'
     parquet_dir = 'C:\\Downloads\\'
+    cache_dir = 'C:\\Downloads\\cache\\'
+    result_cache_dir = 'C:\\Downloads\\result_cache\\'
+    arrow_path = 'C:\\Downloads\\school_data.arrow'
+    state_path = 'C:\\Downloads\\pipeline_state.json'
+    metrics_dir = 'C:\\Downloads\\'
+    archive_raw = True
+    # Parse low-cardinality codes as categoricals and numbers into narrow dtypes
+    compact_dtypes = True
+    # Download large extracts in resumable, parallel byte ranges to a local file
+    resumable_download = False
+    # Only transform the years that changed since the previous run
+    incremental = False
+    # 'arrow' keeps the data as pyarrow Tables from the CSV read to the Parquet write (not in incremental mode)
+    backend = 'pandas'
+    use_arrow = backend == 'arrow' and not incremental
+
+    # Write the log on a background thread, to DATA_PIPELINE_LOG when set
+    configure_logging()
+
+    # Record wall time, CPU time, the process peak RSS so far, rows and bytes of every stage
+    metrics = PipelineMetrics()
 
-    # Create an instance of the DataPipeline class
-    dp = DataPipeline()
+    # Create an instance of the DataPipeline class, re-using unchanged downloads from the local cache
+    dp = DataPipeline(DownloadCache(cache_dir), metrics)
 
     # Download the CSV data from the specified URL
-    data = dp.download_csv_data(url)
-    if dp.save_raw_text(des_dir, data):
-        logging.info('Converting the CSV file to dataframe')
-        # Convert the raw data to a pandas DataFrame
-        school_data = dp.convert_to_dataframe(des_dir)
+    if resumable_download:
+        dp.download_resumable(url, csv_dir + file_name, parts=4)
+        with open(csv_dir + file_name, 'rb') as fread:
+            data = fread.read()
     else:
-        raise Exception('File Cannot be written.')
-    # Perform data validation
-    dv = DataValidator()
-    validate_results = dv.validate(school_data)
-
-    # Perform data transformation
-    dt = DataTransformation()
-    transformed_data, filter_data = dt.data_transform(school_data)
-    logging.info(transformed_data)
-    logging.info(filter_data.head())
-
-    # Description of the transformed data
-    """
-    The transformed_data DataFrame represents the transformed version of the data.
-    It contains the results of the data transformation process, which may include cleaning,
-    reformatting, or aggregating the original data to meet specific requirements.
-    """
+        data = dp.download_csv_bytes(url)
+    # Skip parsing, validation, transformation and writing when the same input was processed with the same settings
+    result_cache = ResultCache(result_cache_dir, metrics=metrics)
+    outputs = {'results1.csv': csv_dir + 'results1.csv', 'results2.csv': csv_dir + 'results2.csv',
+               'results1.parquet': parquet_dir + 'results1.parquet',
+               'results2.parquet': parquet_dir + 'results2.parquet',
+               'results2_dataset': parquet_dir + 'results2_dataset'}
+    if incremental:
+        # The next incremental run diffs against the state of the outputs that were restored
+        outputs['pipeline_state.json'] = state_path
+    result_key = content_hash(data, {'results_version': RESULTS_VERSION, 'compact_dtypes': compact_dtypes,
+                                     'incremental': incremental, 'filter_pattern': FILTER_PATTERN, 'arrow': use_arrow,
+                                     'outputs': sorted(outputs)})
+    cached_outputs = result_cache.lookup(result_key)
+    if cached_outputs is not None:
+        logging.info('Unchanged input, re-using the cached results %s', result_key)
+        dp.restore_outputs(cached_outputs, outputs)
+    else:
+        logging.info('Converting the CSV data to dataframe')
+        # Parse the raw data in memory while the raw archive is written to disk in the background, or reload the
+        # memory-mapped Arrow store when the raw data has not changed since it was parsed. The reload is zero-copy
+        # with the arrow backend only; the pandas backend copies the mapped Table into a DataFrame
+        school_data = dp.load_raw_data(data, des_dir if archive_raw else None, compact_dtypes, arrow_path, use_arrow)
+        if use_arrow:
+            logging.info('Arrow table size: %d bytes', school_data.nbytes)
+        else:
+            logging.info('Memory usage by column:\n%s', summarize(dp.memory_report(school_data), max_rows=20))
+        # Validate the loaded data in a single pass, stopping before the transformation if the file is bad. The
+        # whole file is parsed at this point; DataValidator.validate_stream on the parse batches of
+        # AsyncPipelineRunner or on iter_csv_chunks validates before the full load instead
+        dv = DataValidator(metrics)
+        validate_results = dv.validate_stream([school_data])
 
-    # Description of the filter_data
-    """
-    The filter_data DataFrame represents a subset of the transformed_data based on certain conditions or filters.
-    It contains a filtered view of the transformed data, including only the rows or columns that satisfy specific
-    criteria.
-    """
+        # Perform data transformation
+        dt = DataTransformation(metrics, 'arrow' if use_arrow else 'pandas')
+        if incremental:
+            transformed_data, filter_delta, state = dt.data_transform_incremental(school_data,
+                                                                                 dp.load_state(state_path))
+            filter_data = dp.merge_filter_output(filter_delta, state['changed_years'], csv_dir + 'results2.csv')
+        else:
+            transformed_data, filter_data = dt.data_transform(school_data)
+        logging.info('Transformed data:\n%s', summarize(transformed_data))
+        logging.info('Filtered data:\n%s', summarize(filter_data))
+
+        # Description of the transformed data
+        """
+        The transformed_data DataFrame represents the transformed version of the data.
+        It contains the results of the data transformation process, which may include cleaning,
+        reformatting, or aggregating the original data to meet specific requirements.
+        """
+
+        # Description of the filter_data
+        """
+        The filter_data DataFrame represents a subset of the transformed_data based on certain conditions or filters.
+        It contains a filtered view of the transformed data, including only the rows or columns that satisfy specific
+        criteria.
+        """
 
-    # Save the transformed data and filter_data to CSV files
-    dp.save_data_to_csv(transformed_data, csv_dir + 'results1.csv')
-    dp.save_data_to_csv(filter_data, csv_dir + 'results2.csv')
+        # Save the transformed data and filter_data to CSV and Parquet files concurrently
+        dp.write_outputs([(transformed_data, 'csv', csv_dir + 'results1.csv'),
+                          (filter_data, 'csv', csv_dir + 'results2.csv'),
+                          (transformed_data, 'parquet', parquet_dir + 'results1.parquet'),
+                          (filter_data, 'parquet', parquet_dir + 'results2.parquet')])
+        # Save the filtered data as a year_group-partitioned Parquet dataset for predicate-based reads
+        dp.save_data_to_parquet_dataset(filter_data, parquet_dir + 'results2_dataset', partition_cols=['year_group'],
+                                        compression='zstd')
+        if incremental:
+            dp.save_state(state_path, state)
+        result_cache.store(result_key, outputs)
 
-    # Save the transformed data and filter_data to Parquet files
-    dp.save_data_to_parquet(transformed_data, parquet_dir + 'results1.parquet')
-    dp.save_data_to_parquet(filter_data, parquet_dir + 'results2.parquet')
+    # Export the per-stage metrics
+    metrics.to_json(metrics_dir + 'pipeline_metrics.json')
+    metrics.to_prometheus(metrics_dir + 'pipeline_metrics.prom')
 
     # Calculate the execution time and print the result
     end_time = time.time()
@@ -1,14 +1,498 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
 import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest import mock
 import pandas as pd
+import requests
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 import data_validation
-from data_validation import RecordCountValidator
+from data_validation import DataValidator, RecordCountValidator, ValidationError
 from data_transformation import DataTransformation
 from unittest.mock import MagicMock, patch
+from data_async_pipeline import AsyncPipelineRunner
+from data_cache import DownloadCache, ResultCache, content_hash
+from data_logging import configure_logging, summarize
+from data_metrics import PipelineMetrics
 from data_pipeline import DataPipeline
+from data_service import DataService, create_server
+from data_benchmark import legacy_aggregator_group, generate_eda14_frame, find_regressions
 
 
+class LocalCSVRequestHandler(BaseHTTPRequestHandler):
+    """
+    A stand-in for the PxStat API that serves in-memory CSV payloads from a local HTTP server.
+
+    The payloads are keyed by request path. Responses carry an ETag and answer If-None-Match with 304. Single
+    byte ranges are served with 206 Partial Content, and drop_after simulates a dropped connection by closing it
+    once after the given number of bytes of a path. Paths in gzip_paths are sent with Content-Encoding: gzip to
+    clients that accept it, ranges then indexing the compressed body.
+
+    """
+    payloads = {}
+    requests_seen = []
+    drop_after = {}
+    gzip_paths = set()
+
+    def do_HEAD(self):
+        self.do_GET(send_body=False)
+
+    def do_GET(self, send_body=True):
+        self.requests_seen.append((self.path, dict(self.headers)))
+        body = self.payloads.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        etag = '"' + hashlib.sha256(body).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        gzip_encoded = self.path in self.gzip_paths and 'gzip' in self.headers.get('Accept-Encoding', '')
+        if gzip_encoded:
+            body = gzip.compress(body, mtime=0)
+        byte_range = self.headers.get('Range')
+        if byte_range:
+            start, end = byte_range[len('bytes='):].split('-')
+            start, end = int(start), int(end) if end else len(body) - 1
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, len(body)))
+            body = body[start:end + 1]
+        else:
+            self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Accept-Ranges', 'bytes')
+        if gzip_encoded:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not send_body:
+            return
+        drop_after = self.drop_after.pop(self.path, None)
+        if drop_after is not None and drop_after < len(body):
+            self.wfile.write(body[:drop_after])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalServerTestCase(unittest.TestCase):
+    """
+    Base class for tests that need a local HTTP server running LocalCSVRequestHandler.
+
+    """
+    def setUp(self):
+        LocalCSVRequestHandler.payloads = {}
+        LocalCSVRequestHandler.requests_seen = []
+        LocalCSVRequestHandler.drop_after = {}
+        LocalCSVRequestHandler.gzip_paths = set()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), LocalCSVRequestHandler)
+        self.base_url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.server_thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.server_thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestDownloadCache(LocalServerTestCase):
+    """
+    Unit tests for the DownloadCache class.
+
+    """
+    def test_not_modified_is_served_from_cache(self):
+        """
+        A second download of an unchanged dataset should send If-None-Match and be served from the cache.
+
+        """
+        LocalCSVRequestHandler.payloads['/EDA14'] = b'STATISTIC,VALUE\nEDA14C01,250\n'
+        url = self.base_url + '/EDA14'
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            data_pipeline = DataPipeline(DownloadCache(tmp_dir))
+            first = data_pipeline.download_csv_bytes(url)
+            second = data_pipeline.download_csv_bytes(url)
+
+        self.assertEqual(first, second)
+        self.assertNotIn('If-None-Match', LocalCSVRequestHandler.requests_seen[0][1])
+        self.assertIn('If-None-Match', LocalCSVRequestHandler.requests_seen[1][1])
+
+    def test_not_modified_without_cached_body_downloads_once_more(self):
+        """
+        A 304 whose body was evicted should fall back to one unconditional request, and a destination that cannot
+        be written should raise instead of being treated as a cache miss.
+
+        """
+        LocalCSVRequestHandler.payloads['/EDA14'] = b'STATISTIC,VALUE\nEDA14C01,250\n'
+        url = self.base_url + '/EDA14'
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache = DownloadCache(os.path.join(tmp_dir, 'cache'))
+            data_pipeline = DataPipeline(cache)
+            destination = os.path.join(tmp_dir, 'school_data.csv')
+            data_pipeline.stream_csv_data(url, destination)
+            LocalCSVRequestHandler.requests_seen = []
+
+            # The body is evicted between the conditional request and the copy
+            with patch.object(cache, 'copy_to', return_value=None):
+                self.assertEqual(data_pipeline.stream_csv_data(url, destination), 29)
+            self.assertEqual(len(LocalCSVRequestHandler.requests_seen), 2)
+            self.assertNotIn('If-None-Match', LocalCSVRequestHandler.requests_seen[1][1])
+
+            LocalCSVRequestHandler.requests_seen = []
+            with self.assertRaises(OSError):
+                data_pipeline.stream_csv_data(url, os.path.join(tmp_dir, 'missing', 'school_data.csv'))
+            self.assertEqual(len(LocalCSVRequestHandler.requests_seen), 1)
+
+    def test_evicts_least_recently_used(self):
+        """
+        Storing past max_bytes should evict the least recently used entry.
+
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache = DownloadCache(tmp_dir, max_bytes=10)
+            cache.store('http://local/a', b'123456', {'ETag': '"a"'})
+            os.utime(cache._paths('http://local/a')[0], (0, 0))
+            cache.store('http://local/b', b'123456', {'ETag': '"b"'})
+
+            self.assertIsNone(cache.load('http://local/a'))
+            self.assertEqual(cache.load('http://local/b'), b'123456')
+
+
+class TestResultCache(unittest.TestCase):
+    """
+    Unit tests for the ResultCache class.
+
+    """
+    def test_lookup_hits_only_for_same_content_and_params(self):
+        """
+        A stored result should be found again for the same input and parameters, and missed otherwise.
+
+        """
+        metrics = PipelineMetrics()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_path = os.path.join(tmp_dir, 'results1.csv')
+            with open(output_path, 'w') as fwrite:
+                fwrite.write('year_group,total\n2020-2021,10\n')
+            cache = ResultCache(os.path.join(tmp_dir, 'cache'), metrics=metrics)
+            key = content_hash(b'STATISTIC,VALUE\n', {'compact_dtypes': True})
+
+            self.assertIsNone(cache.lookup(key))
+            cache.store(key, {'results1.csv': output_path})
+            cached_outputs = cache.lookup(key)
+            self.assertIsNone(cache.lookup(content_hash(b'STATISTIC,VALUE\n', {'compact_dtypes': False})))
+
+            with open(cached_outputs['results1.csv']) as fread:
+                self.assertEqual(fread.read(), 'year_group,total\n2020-2021,10\n')
+        self.assertEqual(cache.stats, {'hits': 1, 'misses': 2, 'evictions': 0})
+        self.assertEqual(metrics.counters(), {'result_cache_hits': 1, 'result_cache_misses': 2})
+
+    def test_evicts_least_recently_used(self):
+        """
+        Storing past max_entries should evict the least recently used entry.
+
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_path = os.path.join(tmp_dir, 'results1.csv')
+            with open(output_path, 'w') as fwrite:
+                fwrite.write('year_group,total\n')
+            cache = ResultCache(os.path.join(tmp_dir, 'cache'), max_entries=2)
+            for content in (b'a', b'b', b'c'):
+                cache.store(content_hash(content), {'results1.csv': output_path})
+                if content == b'b':
+                    cache.lookup(content_hash(b'a'))
+
+            self.assertIsNone(cache.lookup(content_hash(b'b')))
+            self.assertIsNotNone(cache.lookup(content_hash(b'a')))
+            self.assertIsNotNone(cache.lookup(content_hash(b'c')))
+        self.assertEqual(cache.stats['evictions'], 1)
+
+    def test_restore_outputs_replaces_files_and_directories(self):
+        """
+        Restoring a hit after runs X, Y should bring back X's files, partitioned dataset and state file.
+
+        """
+        data_pipeline = DataPipeline()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            outputs = {'results2.csv': os.path.join(tmp_dir, 'results2.csv'),
+                       'results2_dataset': os.path.join(tmp_dir, 'results2_dataset'),
+                       'pipeline_state.json': os.path.join(tmp_dir, 'pipeline_state.json')}
+            cache = ResultCache(os.path.join(tmp_dir, 'cache'))
+
+            def run(years):
+                df = pd.DataFrame({'year_group': years, 'value': [1.0] * len(years)})
+                data_pipeline.save_data_atomic(df, 'csv', outputs['results2.csv'])
+                data_pipeline.save_data_to_parquet_dataset(df, outputs['results2_dataset'])
+                data_pipeline.save_state(outputs['pipeline_state.json'], {'years': years})
+                cache.store(content_hash(str(years).encode('utf-8')), outputs)
+
+            run([2010, 2015])
+            run([2020])
+            restored = data_pipeline.restore_outputs(cache.lookup(content_hash(b'[2010, 2015]')), outputs)
+
+            self.assertEqual(sorted(restored), sorted(outputs.values()))
+            self.assertEqual(pd.read_csv(outputs['results2.csv'])['year_group'].tolist(), [2010, 2015])
+            self.assertEqual(sorted(os.listdir(outputs['results2_dataset'])), ['year_group=2010', 'year_group=2015'])
+            self.assertEqual(data_pipeline.load_state(outputs['pipeline_state.json']), {'years': [2010, 2015]})
+            self.assertEqual(sorted(name for name in os.listdir(tmp_dir) if name.startswith('.')), [])
+
+
+class TestResumableDownload(LocalServerTestCase):
+    """
+    Unit tests for the DataPipeline.download_resumable method.
+
+    """
+    def test_parallel_ranges_resume_after_dropped_connection(self):
+        """
+        Parallel byte ranges should be resumed after a dropped connection and joined into the verified file.
+
+        """
+        body = generate_eda14_frame(2000).to_csv(index=False).encode('utf-8')
+        LocalCSVRequestHandler.payloads['/EDA14'] = body
+        LocalCSVRequestHandler.drop_after['/EDA14'] = 1000
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            destination = os.path.join(tmp_dir, 'school_data.csv')
+            total_bytes = DataPipeline().download_resumable(self.base_url + '/EDA14', destination, parts=4,
+                                                            expected_sha256=hashlib.sha256(body).hexdigest(),
+                                                            chunk_size=1024)
+            with open(destination, 'rb') as fread:
+                content = fread.read()
+            leftovers = sorted(os.listdir(tmp_dir))
+
+        # Assertion
+        self.assertEqual(total_bytes, len(body))
+        self.assertEqual(content, body)
+        self.assertEqual(leftovers, ['school_data.csv'])
+        ranges = [headers['Range'] for path, headers in LocalCSVRequestHandler.requests_seen if 'Range' in headers]
+        self.assertEqual(len(ranges), 5)
+
+    def test_resumes_parts_of_interrupted_run_and_rejects_bad_checksum(self):
+        """
+        A part left by an interrupted run should be resumed, and a checksum mismatch should keep the destination out.
+
+        """
+        body = b'STATISTIC,VALUE\n' + b'EDA14C01,250\n' * 500
+        LocalCSVRequestHandler.payloads['/EDA14'] = body
+        LocalCSVRequestHandler.drop_after['/EDA14'] = 3000
+        data_pipeline = DataPipeline()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            destination = os.path.join(tmp_dir, 'school_data.csv')
+            with self.assertRaises(requests.exceptions.RequestException):
+                data_pipeline.download_resumable(self.base_url + '/EDA14', destination, chunk_size=1000, max_retries=0)
+            self.assertEqual(os.path.getsize(destination + '.part0'), 3000)
+            data_pipeline.download_resumable(self.base_url + '/EDA14', destination)
+            with open(destination, 'rb') as fread:
+                content = fread.read()
+            with self.assertRaises(ValueError):
+                data_pipeline.download_resumable(self.base_url + '/EDA14', destination + '.bad',
+                                                 expected_sha256='0' * 64)
+            self.assertFalse(os.path.exists(destination + '.bad'))
+
+        # Assertion
+        self.assertEqual(content, body)
+        self.assertEqual(LocalCSVRequestHandler.requests_seen[-3][1]['Range'], 'bytes=3000-%d' % (len(body) - 1))
+
+    def test_ranges_index_the_unencoded_file(self):
+        """
+        Against a server that gzips responses on the fly, the byte ranges should still index the stored file.
+
+        """
+        body = b'STATISTIC,VALUE\n' + b'EDA14C01,250\n' * 500
+        LocalCSVRequestHandler.payloads['/EDA14'] = body
+        LocalCSVRequestHandler.gzip_paths.add('/EDA14')
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            destination = os.path.join(tmp_dir, 'school_data.csv')
+            written = DataPipeline().download_resumable(self.base_url + '/EDA14', destination, parts=2,
+                                                        chunk_size=1000)
+            with open(destination, 'rb') as fread:
+                content = fread.read()
+
+        # Assertion
+        self.assertEqual(written, len(body))
+        self.assertEqual(content, body)
+        self.assertTrue(all(headers['Accept-Encoding'] == 'identity'
+                            for _, headers in LocalCSVRequestHandler.requests_seen))
+
+
+class TestFetchDatasets(LocalServerTestCase):
+    """
+    Unit tests for the DataPipeline.fetch_datasets method.
+
+    """
+    def test_fetch_datasets_returns_every_dataset(self):
+        """
+        Every requested dataset should be yielded once with its own content.
+
+        """
+        payloads = {'/EDA14': b'STATISTIC,VALUE\nEDA14C01,250\n', '/EDA15': b'STATISTIC,VALUE\nEDA15C01,450\n',
+                    '/EDA16': b'STATISTIC,VALUE\nEDA16C01,650\n'}
+        LocalCSVRequestHandler.payloads.update(payloads)
+        urls = [self.base_url + path for path in payloads]
+
+        results = dict(DataPipeline().fetch_datasets(urls, max_workers=3, per_host_limit=2))
+
+        self.assertEqual(results, {self.base_url + path: body for path, body in payloads.items()})
+
+    def test_dataset_url(self):
+        """
+        A dataset ID should be expanded to its PxStat CSV URL and a URL should be kept as is.
+
+        """
+        data_pipeline = DataPipeline()
+        self.assertEqual(data_pipeline.dataset_url('EDA14'),
+                         'https://ws.cso.ie/public/api.restful/PxStat.Data.Cube_API.ReadDataset/EDA14/CSV/1.0/en')
+        self.assertEqual(data_pipeline.dataset_url('http://127.0.0.1/EDA14'), 'http://127.0.0.1/EDA14')
+
+
+class TestAsyncPipelineRunner(LocalServerTestCase):
+    """
+    Unit tests for the AsyncPipelineRunner class.
+
+    """
+    def test_run_matches_sequential_pipeline(self):
+        """
+        Running the overlapped stages on small batches should give the same outputs as the sequential pipeline.
+
+        """
+        data = generate_eda14_frame(2000)
+        raw_data = data.to_csv(index=False).encode('utf-8')
+        LocalCSVRequestHandler.payloads['/EDA14'] = raw_data
+        expected_df, expected_filter_df = DataTransformation().data_transform(DataPipeline().convert_to_dataframe(
+            raw_data))
+
+        runner = AsyncPipelineRunner(queue_size=2, batch_bytes=4096, chunk_size=1024)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            summary = runner.run(self.base_url + '/EDA14', tmp_dir)
+            filter_df = pd.read_csv(os.path.join(tmp_dir, 'results2.csv'))
+            filter_parquet_df = pd.read_parquet(os.path.join(tmp_dir, 'results2.parquet'))
+            self.assertEqual(sorted(os.listdir(tmp_dir)), ['results1.csv', 'results1.parquet', 'results2.csv',
+                                                           'results2.parquet'])
+
+        # Assertion
+        self.assertEqual(summary['rows'], 2000)
+        self.assertGreater(summary['validation']['batches'], 1)
+        self.assertTrue(summary['validation']['passed'])
+        self.assertEqual(summary['validation']['records'], 2000)
+        pd.testing.assert_frame_equal(summary['aggregated'], expected_df)
+        pd.testing.assert_frame_equal(filter_df, expected_filter_df.reset_index(drop=True))
+        pd.testing.assert_frame_equal(filter_parquet_df, expected_filter_df.reset_index(drop=True))
+
+    def test_run_parses_later_batches_with_the_known_schema(self):
+        """
+        Whole numbers in the first batches and a decimal VALUE later should parse like the sequential pipeline,
+        also when a 304 answer has lost its cached body.
+
+        """
+        data = generate_eda14_frame(2000)
+        data['VALUE'] = data['VALUE'].round().astype('int64').astype(object)
+        data.loc[len(data) - 1, 'VALUE'] = 12.5
+        raw_data = data.to_csv(index=False).encode('utf-8')
+        LocalCSVRequestHandler.payloads['/EDA14'] = raw_data
+        expected_df, _ = DataTransformation().data_transform(DataPipeline().convert_to_dataframe(raw_data))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache = DownloadCache(os.path.join(tmp_dir, 'cache'))
+            DataPipeline(cache).download_csv_bytes(self.base_url + '/EDA14')
+            runner = AsyncPipelineRunner(DataPipeline(cache), batch_bytes=4096, chunk_size=1024)
+            with patch.object(cache, 'load', return_value=None):
+                summary = runner.run(self.base_url + '/EDA14', tmp_dir)
+
+        # Assertion
+        self.assertNotIn('If-None-Match', LocalCSVRequestHandler.requests_seen[-1][1])
+        self.assertEqual(summary['rows'], 2000)
+        pd.testing.assert_frame_equal(summary['aggregated'], expected_df)
+
+    def test_run_writes_empty_outputs_for_header_only_input(self):
+        """
+        A header-only file should write outputs with columns and no rows, and an empty file should raise.
+
+        """
+        header = generate_eda14_frame(1).head(0).to_csv(index=False).encode('utf-8')
+        LocalCSVRequestHandler.payloads['/EDA14'] = header
+        LocalCSVRequestHandler.payloads['/empty'] = b''
+        runner = AsyncPipelineRunner(fail_fast=False)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            summary = runner.run(self.base_url + '/EDA14', tmp_dir)
+            aggregated_df = pd.read_csv(os.path.join(tmp_dir, 'results1.csv'))
+            filter_df = pd.read_csv(os.path.join(tmp_dir, 'results2.csv'))
+            with self.assertRaises(ValueError):
+                runner.run(self.base_url + '/empty', tmp_dir)
+
+        # Assertion
+        self.assertEqual(summary['rows'], 0)
+        self.assertFalse(summary['validation']['passed'])
+        self.assertEqual(list(aggregated_df.columns), ['year_group', 'female', 'male', 'both_sexes'])
+        self.assertEqual(len(aggregated_df), 0)
+        self.assertIn('year_group', filter_df.columns)
+        self.assertEqual(len(filter_df), 0)
+
+    def test_run_propagates_download_errors(self):
+        """
+        A failed download should abort the run with the HTTP error.
+
+        """
+        runner = AsyncPipelineRunner()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with self.assertRaises(Exception):
+                runner.run(self.base_url + '/missing', tmp_dir)
+
+
+class TestDataService(LocalServerTestCase):
+    """
+    Unit tests for the DataService class and its HTTP server.
+
+    """
+    def test_serves_aggregates_and_filtered_slices(self):
+        """
+        The service should answer from memory with the results of the batch pipeline and keep unchanged data.
+
+        """
+        data = generate_eda14_frame(2000)
+        raw_data = data.to_csv(index=False).encode('utf-8')
+        LocalCSVRequestHandler.payloads['/EDA14'] = raw_data
+        expected_df, expected_filter_df = DataTransformation().data_transform(DataPipeline().convert_to_dataframe(
+            raw_data))
+        service = DataService(self.base_url + '/EDA14', compact=False)
+        self.assertTrue(service.refresh())
+        self.assertFalse(service.refresh())
+
+        server = create_server(service, '127.0.0.1', 0)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        service_url = 'http://127.0.0.1:%d' % server.server_address[1]
+        try:
+            aggregates = pd.read_json(service_url + '/aggregates', orient='records')
+            year_group = int(expected_df.index[0])
+            response = requests.get(service_url + '/filtered', params={'year_group': year_group})
+            cached_response = requests.get(service_url + '/filtered', params={'year_group': year_group},
+                                           headers={'If-None-Match': response.headers['ETag']})
+            missing_response = requests.get(service_url + '/missing')
+            regex_response = requests.get(service_url + '/filtered', params={'pattern': '('})
+            negative_response = requests.get(service_url + '/filtered', params={'limit': -1})
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        # Assertion
+        pd.testing.assert_frame_equal(aggregates.set_index('year_group'), expected_df, check_dtype=False)
+        expected_slice = expected_filter_df[expected_filter_df['year_group'] == year_group]
+        self.assertEqual(len(response.json()), len(expected_slice))
+        self.assertEqual(cached_response.status_code, 304)
+        self.assertEqual(missing_response.status_code, 404)
+        self.assertEqual(regex_response.status_code, 200)
+        self.assertEqual(regex_response.json(), [])
+        self.assertEqual(negative_response.status_code, 400)
 
 
 class TestDataPipeline(unittest.TestCase):
@@ -42,6 +526,124 @@ class TestDataPipeline(unittest.TestCase):
             mock_get.assert_called_once_with(self.url)
             self.assertEqual(data, 'test data')
 
+    def test_stream_csv_data(self):
+        """
+        Test the stream_csv_data method of DataPipeline.
+
+        This method should write every streamed chunk to the destination file and return the number of bytes written.
+
+        """
+        with patch('requests.get') as mock_get:
+            mock_response = MagicMock()
+            mock_response.iter_content.return_value = [b'STATISTIC,VALUE\n', b'', b'EDA14C01,250\n']
+            mock_response.__enter__.return_value = mock_response
+            mock_get.return_value = mock_response
+
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                destination = os.path.join(tmp_dir, 'school_data.csv')
+                data_pipeline = DataPipeline()
+                written = data_pipeline.stream_csv_data(self.url, destination, chunk_size=16)
+
+                mock_get.assert_called_once_with(self.url, stream=True)
+                mock_response.iter_content.assert_called_once_with(chunk_size=16)
+                with open(destination, 'rb') as fread:
+                    self.assertEqual(fread.read(), b'STATISTIC,VALUE\nEDA14C01,250\n')
+                self.assertEqual(written, 29)
+
+    def test_load_raw_data_parses_bytes_and_archives(self):
+        """
+        Test the load_raw_data method of DataPipeline.
+
+        This method should parse the raw bytes in memory and write the same bytes to the raw archive.
+
+        """
+        raw_data = b'STATISTIC,Year,Sex,VALUE\nEDA14C01,2010,Male,250\nEDA14C01,2015,Female,450\n'
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            destination = os.path.join(tmp_dir, 'school_data.csv')
+            data_pipeline = DataPipeline()
+            data = data_pipeline.load_raw_data(raw_data, destination)
+
+            with open(destination, 'rb') as fread:
+                self.assertEqual(fread.read(), raw_data)
+        self.assertEqual(list(data.columns), ['STATISTIC', 'Year', 'Sex', 'VALUE'])
+        self.assertEqual(data['VALUE'].tolist(), [250, 450])
+
+    def test_compressed_raw_archive_round_trip(self):
+        """
+        Test that save_raw_text compresses the raw archive by extension and convert_to_dataframe reads it back.
+
+        """
+        raw_data = generate_eda14_frame(5000).to_csv(index=False).encode('utf-8')
+        data_pipeline = DataPipeline()
+        expected_df = data_pipeline.convert_to_dataframe(raw_data)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for extension in ('.zst', '.gz', '.lz4'):
+                with self.subTest(extension=extension):
+                    destination = os.path.join(tmp_dir, 'school_data.csv' + extension)
+                    self.assertTrue(data_pipeline.save_raw_text(destination, raw_data))
+                    with open(destination, 'rb') as fread:
+                        archived = fread.read()
+
+                    # Assertion
+                    self.assertLess(len(archived), len(raw_data) // 2)
+                    pd.testing.assert_frame_equal(data_pipeline.convert_to_dataframe(destination), expected_df)
+                    pd.testing.assert_frame_equal(data_pipeline.convert_to_dataframe(archived), expected_df)
+
+    def test_convert_to_dataframe_compact(self):
+        """
+        Test the compact mode of the convert_to_dataframe method of DataPipeline.
+
+        The known columns should be parsed into compact dtypes and the transformation should give the same
+        aggregate as with the default dtypes.
+
+        """
+        raw_data = (b'STATISTIC,Statistic Label,C02351V02955,Type of School,C02199V02655,Sex,TLIST(A1),Year,UNIT,'
+                    b'VALUE\n'
+                    b'EDA14C01,First Year Students,10,Community School,1,Male,2010,2010,Number,250\n'
+                    b'EDA14C01,First Year Students,10,Community School,2,Female,2016,2016,Number,450\n')
+        data_pipeline = DataPipeline()
+        data = data_pipeline.convert_to_dataframe(raw_data, compact=True)
+        report = data_pipeline.memory_report(data)
+
+        # Assertion
+        self.assertEqual(data['Sex'].dtype, 'category')
+        self.assertEqual(data['Year'].dtype, 'int16')
+        self.assertEqual(data['VALUE'].dtype, 'float32')
+        self.assertEqual(report.loc['total', 'bytes'], report['bytes'].iloc[:-1].sum())
+        expected_df, _ = DataTransformation().data_transform(data_pipeline.convert_to_dataframe(raw_data))
+        df, filter_df = DataTransformation().data_transform(data)
+        pd.testing.assert_frame_equal(df, expected_df, check_dtype=False)
+        self.assertEqual(len(filter_df), 2)
+
+    def test_load_raw_data_reloads_arrow_store(self):
+        """
+        Test that load_raw_data reloads an unchanged dataset from its Arrow store and reparses a changed one.
+
+        """
+        raw_data = generate_eda14_frame(500).to_csv(index=False).encode('utf-8')
+        changed_raw_data = generate_eda14_frame(500, seed=1).to_csv(index=False).encode('utf-8')
+        data_pipeline = DataPipeline()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            arrow_path = os.path.join(tmp_dir, 'school_data.arrow')
+            expected_df = data_pipeline.load_raw_data(raw_data, compact=True, arrow_path=arrow_path)
+            with patch.object(data_pipeline, 'convert_to_dataframe', wraps=data_pipeline.convert_to_dataframe) as parse:
+                reloaded_df = data_pipeline.load_raw_data(raw_data, compact=True, arrow_path=arrow_path)
+                self.assertEqual(parse.call_count, 0)
+                data_pipeline.load_raw_data(changed_raw_data, compact=True, arrow_path=arrow_path)
+                self.assertEqual(parse.call_count, 1)
+            self.assertIsNone(data_pipeline.open_arrow_store(arrow_path, 'unknown'))
+            self.assertEqual(data_pipeline.open_arrow_store(arrow_path).num_rows, 500)
+            # A Table reload references the mapped file, without allocating memory for the data
+            allocated_bytes = pa.total_allocated_bytes()
+            reloaded_table = data_pipeline.load_raw_data(changed_raw_data, compact=True, arrow_path=arrow_path,
+                                                         as_table=True)
+            self.assertEqual(pa.total_allocated_bytes(), allocated_bytes)
+            self.assertEqual(reloaded_table.num_rows, 500)
+            del reloaded_table
+
+        # Assertion
+        pd.testing.assert_frame_equal(reloaded_df, expected_df)
+
     def test_filter_and_transform_data(self):
         """
         Test the filter_and_transform_data method of DataPipeline.
@@ -78,6 +680,333 @@ class TestDataPipeline(unittest.TestCase):
         # Assertion
         self.assertEqual(len(df), len(expected_df))
 
+    def test_aggregator_group_matches_legacy(self):
+        """
+        Test the aggregator_group method of DataTransformation.
+
+        The vectorized aggregation should give exactly the same frame as the original lambda-based implementation,
+        including groups without female or male rows and missing values.
+
+        """
+        data = pd.DataFrame({
+            'year': [2010, 2011, 2012, 2015, 2016, 2020],
+            'sex': ['Female', 'Male', 'Both sexes', 'Both sexes', 'Male', 'Female'],
+            'value': [150.0, 100.0, 250.0, 450.0, None, 75.0]
+        })
+        expected_df = legacy_aggregator_group(data.copy())
+        df = DataTransformation().aggregator_group(data.copy())
+        # Assertion
+        pd.testing.assert_frame_equal(df, expected_df)
+
+    def test_data_transform_chunked_matches_in_memory(self):
+        """
+        Test the data_transform_chunked method of DataTransformation.
+
+        Reading the CSV in small batches should give the same aggregate and the same filtered rows as transforming
+        the whole frame in memory.
+
+        """
+        data = pd.DataFrame({
+            'Statistic Label': ['First Year Students', 'Second Year Students', 'First Year Students',
+                                'Second Year Students', 'First Year Students'],
+            'Sex': ['Female', 'Male', 'Both sexes', 'Female', 'Male'],
+            'Year': [2010, 2011, 2015, 2016, 2021],
+            'VALUE': [150.0, 100.0, 250.0, 450.0, 75.0]
+        })
+        expected_df, expected_filter_df = DataTransformation().data_transform(data.copy())
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source = os.path.join(tmp_dir, 'school_data.csv')
+            filter_destination = os.path.join(tmp_dir, 'results2.csv')
+            data.to_csv(source, index=False)
+            df, filtered_rows = DataTransformation().data_transform_chunked(source, filter_destination, chunksize=2)
+            filter_df = pd.read_csv(filter_destination)
+        # Assertion
+        pd.testing.assert_frame_equal(df, expected_df)
+        self.assertEqual(filtered_rows, len(expected_filter_df))
+        pd.testing.assert_frame_equal(filter_df, expected_filter_df.reset_index(drop=True))
+
+    def test_data_transform_parallel_matches_serial(self):
+        """
+        Test the data_transform_parallel method of DataTransformation.
+
+        Aggregating and filtering row blocks in worker processes should give the same results as data_transform.
+
+        """
+        data = generate_eda14_frame(1000)
+        expected_df, expected_filter_df = DataTransformation().data_transform(data.copy())
+        df, filter_df = DataTransformation().data_transform_parallel(data.copy(), workers=2)
+        # Assertion
+        pd.testing.assert_frame_equal(df, expected_df)
+        pd.testing.assert_frame_equal(filter_df, expected_filter_df)
+
+    def test_data_filter_with_shared_index(self):
+        """
+        Test the data_filter method of DataTransformation with an index built by build_index.
+
+        One index should serve several predicates, give the same rows as a per-row substring scan and never match
+        missing labels.
+
+        """
+        data = pd.DataFrame({
+            'statistic label': ['First Year Students', None, 'Second Year Students', 'First Year Students'],
+            'value': [150.0, 100.0, 250.0, 450.0]
+        })
+        transformation = DataTransformation()
+        index = transformation.build_index(data)
+        first_year = transformation.data_filter(data, 'First Year', index)
+        second_year = transformation.data_filter(data, lambda labels: labels == 'Second Year Students', index)
+        categorical = transformation.data_filter(data.astype({'statistic label': 'category'}), 'First Year')
+
+        # Assertion
+        self.assertEqual(first_year.index.tolist(), [0, 3])
+        self.assertEqual(second_year.index.tolist(), [2])
+        self.assertEqual(categorical.index.tolist(), [0, 3])
+
+    def test_arrow_backend_matches_pandas_backend(self):
+        """
+        Test that the Arrow backend gives the results of the pandas backend as Tables and writes the same files.
+
+        """
+        raw_data = generate_eda14_frame(3000).to_csv(index=False).encode('utf-8')
+        data_pipeline = DataPipeline()
+        expected_df, expected_filter_df = DataTransformation().data_transform(
+            data_pipeline.convert_to_dataframe(raw_data, compact=True))
+
+        table = data_pipeline.load_raw_data(raw_data, compact=True, as_table=True)
+        report = DataValidator().validate_stream([table])
+        # Any use of pandas on the way from the transformation to the written Parquet files fails
+        with patch('data_transformation.pd', None), patch('data_pipeline.pd', None):
+            df, filter_df = DataTransformation(backend='arrow').data_transform(table)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            written = {}
+            for backend, results in (('pandas', (expected_df, expected_filter_df)), ('arrow', (df, filter_df))):
+                paths = [os.path.join(tmp_dir, '%s_results%d.%s' % (backend, number, data_format))
+                         for number in (1, 2) for data_format in ('csv', 'parquet')]
+                with patch('data_pipeline.pd', None if backend == 'arrow' else pd):
+                    data_pipeline.write_outputs([(results[0], 'csv', paths[0]), (results[0], 'parquet', paths[1]),
+                                                 (results[1], 'csv', paths[2]), (results[1], 'parquet', paths[3])])
+                written[backend] = []
+                for path in paths:
+                    with open(path, 'rb') as fread:
+                        written[backend].append(fread.read() if path.endswith('.csv') else pd.read_parquet(path))
+
+        # Assertion
+        self.assertTrue(report['passed'])
+        self.assertIsInstance(df, pa.Table)
+        self.assertIn(b'year_group,female,male,both_sexes\n', written['pandas'][0])
+        for pandas_output, arrow_output in zip(written['pandas'], written['arrow']):
+            if isinstance(pandas_output, bytes):
+                self.assertEqual(arrow_output, pandas_output)
+            else:
+                pd.testing.assert_frame_equal(arrow_output, pandas_output)
+
+    def test_rollup_cube_answers_group_by_queries(self):
+        """
+        Test that the rollup cube reproduces aggregator_group and answers other group-by queries without the rows.
+
+        """
+        data = generate_eda14_frame(3000)
+        data.columns = data.columns.str.lower()
+        data_transformation = DataTransformation()
+        cube = data_transformation.build_cube(data)
+        expected_df = data_transformation.aggregator_group(data.copy())
+        male_data = data[data['sex'] == 'Male']
+        expected_by_school = male_data.groupby(male_data['year'] // 10 * 10)['value'].sum()
+
+        by_school = cube.query(['year'], {'year': 10}, {'sex': 'Male'})
+
+        # Assertion
+        self.assertLess(len(cube.cells), len(data))
+        pd.testing.assert_frame_equal(cube.year_group_by_sex(), expected_df, check_dtype=False)
+        pd.testing.assert_series_equal(by_school['sum'], expected_by_school, check_names=False)
+        self.assertEqual(cube.query([])['count'].iloc[0], data['value'].count())
+        with self.assertRaises(ValueError):
+            cube.query(['year'], {'year': 2.5})
+
+    def test_transformation_plan_matches_data_transform(self):
+        """
+        Test the lazy TransformationPlan of DataTransformation.
+
+        The plan should read only the columns it needs and give the same aggregate and filtered rows as
+        data_transform.
+
+        """
+        data = generate_eda14_frame(500)
+        expected_df, expected_filter_df = DataTransformation().data_transform(data.copy())
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source = os.path.join(tmp_dir, 'school_data.csv')
+            data.to_csv(source, index=False)
+            plan = DataTransformation().plan().aggregate().filter('First Year', columns=['Year', 'Sex', 'VALUE'])
+            df, filter_df = plan.execute(source, chunksize=128)
+
+        # Assertion
+        self.assertEqual(plan.required_columns(), {'statistic label', 'year', 'sex', 'value'})
+        pd.testing.assert_frame_equal(df, expected_df)
+        pd.testing.assert_frame_equal(filter_df, expected_filter_df[['year', 'sex', 'value']].reset_index(drop=True))
+
+    def test_data_transform_incremental_matches_full_run(self):
+        """
+        Test the data_transform_incremental method of DataTransformation.
+
+        A second run that changes one year and adds another should only transform those two years, and the
+        merged outputs should match a full transformation of the new data.
+
+        """
+        first_run = pd.DataFrame({
+            'Statistic Label': ['First Year Students', 'Second Year Students', 'First Year Students',
+                                'First Year Students'],
+            'Sex': ['Female', 'Male', 'Both sexes', 'Female'],
+            'Year': [2010, 2011, 2015, 2016],
+            'VALUE': [150.0, 100.0, 250.0, 450.0]
+        })
+        second_run = pd.concat([first_run.iloc[:3], pd.DataFrame({
+            'Statistic Label': ['First Year Students', 'First Year Students'],
+            'Sex': ['Male', 'Female'],
+            'Year': [2016, 2021],
+            'VALUE': [500.0, 75.0]
+        })], ignore_index=True)
+        expected_df, expected_filter_df = DataTransformation().data_transform(second_run.copy())
+
+        data_pipeline = DataPipeline()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            state_path = os.path.join(tmp_dir, 'pipeline_state.json')
+            filter_path = os.path.join(tmp_dir, 'results2.csv')
+            _, filter_df, state = DataTransformation().data_transform_incremental(first_run.copy(),
+                                                                                  data_pipeline.load_state(state_path))
+            data_pipeline.save_data_to_csv(filter_df, filter_path)
+            data_pipeline.save_state(state_path, state)
+
+            df, filter_delta, state = DataTransformation().data_transform_incremental(
+                second_run.copy(), data_pipeline.load_state(state_path))
+            filter_df = data_pipeline.merge_filter_output(filter_delta, state['changed_years'], filter_path)
+        # Assertion
+        self.assertEqual(state['changed_years'], [2016, 2021])
+        self.assertEqual(sorted(filter_delta['year']), [2016, 2021])
+        pd.testing.assert_frame_equal(df, expected_df)
+        pd.testing.assert_frame_equal(filter_df, expected_filter_df.sort_values('year', kind='stable',
+                                                                                ignore_index=True))
+
+    def test_configure_logging_formats_on_listener_thread(self):
+        """
+        Records should be formatted on the listener thread and DataFrames should be logged as capped summaries.
+
+        """
+        class ThreadRecorder:
+            def __str__(self):
+                self.thread = threading.current_thread()
+                return 'recorded'
+
+        root = logging.getLogger()
+        previous_handlers, previous_level = list(root.handlers), root.level
+        recorder = ThreadRecorder()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log_path = os.path.join(tmp_dir, 'pipeline.log')
+            try:
+                listener = configure_logging(log_path)
+                logging.info('Transformed data:\n%s', summarize(generate_eda14_frame(10000)))
+                logging.info('Argument: %s', recorder)
+                listener.stop()
+                listener.handlers[0].close()
+            finally:
+                for handler in list(root.handlers):
+                    root.removeHandler(handler)
+                for handler in previous_handlers:
+                    root.addHandler(handler)
+                root.setLevel(previous_level)
+            with open(log_path) as fread:
+                log_text = fread.read()
+
+        # Assertion
+        self.assertIn('shape=(10000, 10)', log_text)
+        self.assertLess(len(log_text), 5000)
+        self.assertIn('Argument: recorded', log_text)
+        self.assertIsNot(recorder.thread, threading.current_thread())
+
+    def test_pipeline_metrics(self):
+        """
+        Test the PipelineMetrics instrumentation of the pipeline stages.
+
+        Parsing, transforming and writing should each record a stage, and both exports should contain them.
+
+        """
+        raw_data = b'Statistic Label,Sex,Year,VALUE\nFirst Year Students,Male,2010,250\n'
+        metrics = PipelineMetrics()
+        data_pipeline = DataPipeline(metrics=metrics)
+        data = data_pipeline.convert_to_dataframe(raw_data)
+        df, _ = DataTransformation(metrics).data_transform(data)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            data_pipeline.write_outputs([(df, 'csv', os.path.join(tmp_dir, 'results1.csv'))])
+            metrics.to_json(os.path.join(tmp_dir, 'metrics.json'))
+            metrics.to_prometheus(os.path.join(tmp_dir, 'metrics.prom'))
+            with open(os.path.join(tmp_dir, 'metrics.json')) as fread:
+                exported = json.load(fread)
+            with open(os.path.join(tmp_dir, 'metrics.prom')) as fread:
+                prometheus = fread.read()
+
+        stages = {record['stage']: record for record in exported['stages']}
+        # Assertion
+        self.assertEqual(list(stages), ['parse', 'transform:lower_case', 'transform:aggregate', 'transform:filter',
+                                        'write:results1.csv'])
+        self.assertEqual(stages['parse']['rows'], 1)
+        self.assertEqual(stages['parse']['bytes'], len(raw_data))
+        self.assertGreater(stages['write:results1.csv']['bytes'], 0)
+        self.assertIn('data_pipeline_stage_wall_seconds{stage="parse"}', prometheus)
+        self.assertIn('process_peak_rss_bytes', stages['parse'])
+
+    def test_pipeline_metrics_merges_repeated_stages(self):
+        """
+        Test that a stage recorded twice is exported as a single Prometheus series.
+
+        """
+        metrics = PipelineMetrics()
+        for nbytes in (100, 250):
+            with metrics.stage('download', nbytes=nbytes):
+                pass
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            metrics.to_prometheus(os.path.join(tmp_dir, 'metrics.prom'))
+            with open(os.path.join(tmp_dir, 'metrics.prom')) as fread:
+                lines = [line for line in fread.read().splitlines() if not line.startswith('#')]
+        series = [line.split(' ')[0] for line in lines]
+
+        # Assertion
+        self.assertEqual(len(series), len(set(series)))
+        self.assertIn('data_pipeline_stage_bytes{stage="download"} 350.0', lines)
+        self.assertIn('data_pipeline_stage_runs{stage="download"} 2.0', lines)
+
+    def test_generate_eda14_frame(self):
+        """
+        Test the synthetic EDA14 generator used by the benchmark suite.
+
+        The generated frame should have the EDA14 columns and pass through the transformation.
+
+        """
+        data = generate_eda14_frame(1000)
+        # Assertion
+        self.assertEqual(list(data.columns), ['STATISTIC', 'Statistic Label', 'C02351V02955', 'Type of School',
+                                              'C02199V02655', 'Sex', 'TLIST(A1)', 'Year', 'UNIT', 'VALUE'])
+        self.assertEqual(len(data), 1000)
+        self.assertEqual(data['Sex'].nunique(), 3)
+        df, filter_df = DataTransformation().data_transform(data)
+        self.assertEqual(df['both_sexes'].sum(), data['value'].sum())
+        self.assertTrue(filter_df['statistic label'].eq('First Year Students').all())
+
+    def test_find_regressions(self):
+        """
+        Test the regression check of the benchmark suite.
+
+        Only stages slower than the previous run by more than the threshold should be reported.
+
+        """
+        previous_run = {'version': 'abc1234', 'results': [{'size': 1000, 'stage': 'parse', 'wall_seconds': 1.0},
+                                                          {'size': 1000, 'stage': 'validate', 'wall_seconds': 1.0}]}
+        results = [{'size': 1000, 'stage': 'parse', 'wall_seconds': 1.1},
+                   {'size': 1000, 'stage': 'validate', 'wall_seconds': 2.0},
+                   {'size': 10000, 'stage': 'parse', 'wall_seconds': 5.0}]
+        regressions = find_regressions(previous_run, results, threshold=1.25)
+        # Assertion
+        self.assertEqual([(regression['size'], regression['stage']) for regression in regressions],
+                         [(1000, 'validate')])
+
     def test_save_data_to_csv(self):
         """
         Test the save_data_to_csv method of DataPipeline.
@@ -130,6 +1059,84 @@ class TestDataPipeline(unittest.TestCase):
             # Assertion
             mock_to_parquet.assert_called_once_with(filename, index=False)
 
+    def test_save_data_to_parquet_dataset(self):
+        """
+        Test the save_data_to_parquet_dataset method of DataPipeline.
+
+        Both engines should write one Hive-style directory per year_group and the dataset should be readable with
+        a partition predicate.
+
+        """
+        df = pd.DataFrame({
+            'statistic label': ['First Year Students', 'First Year Students', 'First Year Students'],
+            'year': [2010, 2016, 2017],
+            'value': [150.0, 250.0, 450.0],
+            'year_group': [2010, 2015, 2015]
+        })
+        for engine in ('pyarrow', 'fastparquet'):
+            with self.subTest(engine=engine), tempfile.TemporaryDirectory() as tmp_dir:
+                dataset_path = os.path.join(tmp_dir, 'results2_dataset')
+                data_pipeline = DataPipeline()
+                data_pipeline.save_data_to_parquet_dataset(df, dataset_path, compression='zstd', row_group_size=1,
+                                                           engine=engine)
+                table = pq.read_table(dataset_path, filters=[('year_group', '=', 2015)])
+
+                # Assertion
+                self.assertEqual(sorted(name for name in os.listdir(dataset_path) if not name.startswith('_')),
+                                 ['year_group=2010', 'year_group=2015'])
+                self.assertEqual(sorted(table.column('year').to_pylist()), [2016, 2017])
+
+    def test_write_outputs(self):
+        """
+        Test the write_outputs method of DataPipeline.
+
+        Every target should be written in its format and no temporary file should be left behind.
+
+        """
+        df = pd.DataFrame({
+            'year_group': [2010, 2015],
+            'female': [150, 250],
+            'male': [100, 200],
+            'both_sexes': [250, 450]
+        })
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            csv_path = os.path.join(tmp_dir, 'results1.csv')
+            parquet_path = os.path.join(tmp_dir, 'results1.parquet')
+            data_pipeline = DataPipeline()
+            written = data_pipeline.write_outputs([(df, 'csv', csv_path), (df, 'parquet', parquet_path)])
+
+            # Assertion
+            self.assertEqual(written, [csv_path, parquet_path])
+            self.assertEqual(sorted(os.listdir(tmp_dir)), ['results1.csv', 'results1.parquet'])
+            pd.testing.assert_frame_equal(pd.read_csv(csv_path), df)
+            pd.testing.assert_frame_equal(pd.read_parquet(parquet_path), df)
+            # Outputs get the same permissions as any file created under the current umask
+            plain_path = os.path.join(tmp_dir, 'plain.csv')
+            df.to_csv(plain_path, index=False)
+            self.assertEqual(os.stat(csv_path).st_mode, os.stat(plain_path).st_mode)
+
+    def test_save_data_atomic_keeps_previous_file_on_failure(self):
+        """
+        Test the save_data_atomic method of DataPipeline.
+
+        A failed write should leave the previous output untouched and remove its temporary file.
+
+        """
+        df = pd.DataFrame({'year_group': [2010, 2015]})
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            csv_path = os.path.join(tmp_dir, 'results1.csv')
+            with open(csv_path, 'w') as fwrite:
+                fwrite.write('previous')
+            data_pipeline = DataPipeline()
+            with patch('pandas.DataFrame.to_csv', side_effect=OSError('disk full')):
+                with self.assertRaises(OSError):
+                    data_pipeline.save_data_atomic(df, 'csv', csv_path)
+
+            # Assertion
+            self.assertEqual(os.listdir(tmp_dir), ['results1.csv'])
+            with open(csv_path) as fread:
+                self.assertEqual(fread.read(), 'previous')
+
     def test_filter_and_transform_data_called_with_downloaded_data(self):
         """
         Test the filter_and_transform_data method of DataPipeline with downloaded data.
@@ -183,6 +1190,37 @@ class TestDataPipeline(unittest.TestCase):
             with self.assertRaises(Exception):
                 data_pipeline.download_csv_data()
 
+    def test_validate_stream_fails_fast(self):
+        """
+        Test that validate_stream stops at the first bad batch and reports every problem when not failing fast.
+
+        """
+        good_batch = generate_eda14_frame(100)
+        bad_batch = generate_eda14_frame(100, seed=1)
+        bad_batch['Year'] = bad_batch['Year'].astype(float)
+        bad_batch.loc[3, 'Year'] = None
+        read_batches = []
+
+        def batches():
+            for batch in (good_batch, bad_batch, good_batch):
+                read_batches.append(batch)
+                yield batch
+
+        data_validator = DataValidator()
+        with self.assertRaises(ValidationError) as raised:
+            data_validator.validate_stream(batches())
+        report = data_validator.validate_stream([good_batch, bad_batch.drop(columns=['Sex'])], fail_fast=False)
+        arrow_report = data_validator.validate_stream([pa.Table.from_pandas(good_batch)])
+
+        # Assertion
+        self.assertEqual(len(read_batches), 2)
+        self.assertEqual(raised.exception.report['records'], 200)
+        self.assertEqual(raised.exception.report['null_counts']['year'], 1)
+        self.assertFalse(report['passed'])
+        self.assertEqual(len(report['errors']), 3)
+        self.assertTrue(arrow_report['passed'])
+        self.assertEqual(arrow_report['records'], 100)
+
     def test_record_valdiation(self):
         """
         Test the record_validate method of RecordCountValidator.
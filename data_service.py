@@ -0,0 +1,315 @@
+import argparse
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from data_cache import DownloadCache, content_hash
+from data_logging import configure_logging
+from data_pipeline import DataPipeline
+from data_transformation import DataTransformation, FILTER_PATTERN
+from data_validation import DataValidator
+
+# URL of the EDA14 dataset served by default
+SERVICE_DATASET_URL = 'https://ws.cso.ie/public/api.restful/PxStat.Data.Cube_API.ReadDataset/EDA14/CSV/1.0/en'
+SERVICE_PORT = 8000
+# Seconds between two refreshes of the in-memory dataset
+SERVICE_REFRESH_INTERVAL = 3600
+# Maximum number of encoded responses kept in memory
+RESPONSE_CACHE_SIZE = 256
+# Maximum number of rows returned by the /filtered endpoint
+SERVICE_MAX_ROWS = 10000
+
+
+class DataService:
+    """
+    A resident copy of the pipeline output that answers queries from memory.
+
+    The dataset is downloaded, parsed, validated and transformed once, then kept in memory with its year-group
+    aggregates and a dictionary index of the 'statistic label' column. A background thread refreshes it on a
+    schedule; unchanged downloads, recognised by their content hash, are not processed again. Encoded responses are
+    cached until the next change of the dataset.
+
+    Attributes:
+        _url (str): The URL of the CSV file.
+        _pipeline (DataPipeline): The pipeline used to download and parse the dataset.
+        _transformation (DataTransformation): The transformation applied to the dataset.
+        _validator (DataValidator): The validator applied to the dataset.
+        _compact (bool): Whether the dataset is parsed with compact dtypes.
+        _cache_size (int): The maximum number of encoded responses kept in memory.
+        _snapshot (dict or None): The current dataset, its aggregates, index, validation results and version.
+        _responses (OrderedDict): The encoded responses of the current version, least recently used first.
+        _lock (threading.Lock): Protects _snapshot and _responses.
+        _stop (threading.Event): Set to stop the refresh thread.
+
+    Methods:
+        refresh: Reloads the dataset if it changed.
+        start_refresh: Starts refreshing the dataset on a schedule.
+        stop_refresh: Stops the scheduled refreshes.
+        query: Returns the encoded response to a request.
+        aggregates: Returns the year-group aggregates.
+        filtered: Returns a filtered slice of the dataset.
+    """
+    def __init__(self, url=SERVICE_DATASET_URL, pipeline=None, transformation=None, validator=None, compact=True,
+                 cache_size=RESPONSE_CACHE_SIZE):
+        self._url = url
+        self._pipeline = pipeline or DataPipeline()
+        self._transformation = transformation or DataTransformation()
+        self._validator = validator or DataValidator()
+        self._compact = compact
+        self._cache_size = cache_size
+        self._snapshot = None
+        self._responses = OrderedDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._refresh_thread = None
+
+    def refresh(self):
+        """
+        Downloads the dataset and reloads it if its content changed since the last refresh.
+
+        Returns:
+            bool: True if the dataset was reloaded, False if it was unchanged.
+        """
+        raw_data = self._pipeline.download_csv_bytes(self._url)
+        version = content_hash(raw_data, {'compact': self._compact})
+        if self._snapshot is not None and self._snapshot['version'] == version:
+            logging.info('Dataset unchanged, keeping version %s', version)
+            return False
+        data = self._pipeline.convert_to_dataframe(raw_data, self._compact)
+        validation = self._validator.validate_stream([data])
+        data_lowercase = self._transformation.all_column_lower_case(data)
+        aggregated = self._transformation.aggregator_group(data_lowercase)
+        snapshot = {'version': version, 'loaded_at': time.time(), 'rows': len(data_lowercase),
+                    'data': data_lowercase, 'aggregated': aggregated, 'validation': validation,
+                    'index': self._transformation.build_index(data_lowercase)}
+        with self._lock:
+            self._snapshot = snapshot
+            self._responses.clear()
+        logging.info('Loaded version %s of the dataset: %d rows', version, snapshot['rows'])
+        return True
+
+    def start_refresh(self, interval=SERVICE_REFRESH_INTERVAL):
+        """
+        Starts a daemon thread that calls refresh every interval seconds. Failed refreshes keep the current data.
+
+        Args:
+            interval (float): The number of seconds between two refreshes.
+
+        Returns:
+            threading.Thread: The refresh thread.
+        """
+        def refresh_loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.refresh()
+                except Exception as e:
+                    logging.info('Refresh failed, serving the previous version :: %s', e)
+
+        self._stop.clear()
+        self._refresh_thread = threading.Thread(target=refresh_loop, name='data-service-refresh', daemon=True)
+        self._refresh_thread.start()
+        return self._refresh_thread
+
+    def stop_refresh(self):
+        """
+        Stops the scheduled refreshes and waits for the refresh thread.
+
+        Returns:
+            None
+        """
+        self._stop.set()
+        if self._refresh_thread is not None:
+            self._refresh_thread.join()
+            self._refresh_thread = None
+
+    def query(self, path, params):
+        """
+        Returns the encoded response to a request, from the response cache when possible.
+
+        Args:
+            path (str): The endpoint: '/health', '/aggregates' or '/filtered'.
+            params (dict): The query parameters, one value per name.
+
+        Returns:
+            Tuple[bytes, str]: The JSON body and the version of the dataset it was computed from.
+
+        Raises:
+            KeyError: If the endpoint does not exist.
+            ValueError: If a parameter is invalid.
+            RuntimeError: If the dataset has not been loaded yet.
+        """
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None:
+                raise RuntimeError('The dataset has not been loaded yet.')
+            key = (snapshot['version'], path, tuple(sorted(params.items())))
+            body = self._responses.get(key)
+            if body is not None:
+                self._responses.move_to_end(key)
+                return body, snapshot['version']
+
+        if path == '/health':
+            body = json.dumps({'status': 'ok', 'version': snapshot['version'], 'rows': snapshot['rows'],
+                               'loaded_at': snapshot['loaded_at'], 'validation': snapshot['validation']})
+        elif path == '/aggregates':
+            body = self.aggregates(snapshot, params.get('year_group')).to_json(orient='records')
+        elif path == '/filtered':
+            body = self.filtered(snapshot, params.get('pattern', FILTER_PATTERN), params.get('year_group'),
+                                 int(params.get('limit', SERVICE_MAX_ROWS))).to_json(orient='records')
+        else:
+            raise KeyError(path)
+        body = body.encode('utf-8')
+
+        with self._lock:
+            if self._snapshot is snapshot:
+                self._responses[key] = body
+                while len(self._responses) > self._cache_size:
+                    self._responses.popitem(last=False)
+        return body, snapshot['version']
+
+    def aggregates(self, snapshot, year_group=None):
+        """
+        Returns the year-group aggregates, optionally for a single year group.
+
+        Args:
+            snapshot (dict): The dataset to query.
+            year_group (str or None): The first year of the year group, or None for all of them.
+
+        Returns:
+            pandas.DataFrame: One row per year group with its 'female', 'male' and 'both_sexes' sums.
+        """
+        aggregated = snapshot['aggregated']
+        if year_group is not None:
+            aggregated = aggregated[aggregated.index == int(year_group)]
+        return aggregated.reset_index()
+
+    def filtered(self, snapshot, pattern=FILTER_PATTERN, year_group=None, limit=SERVICE_MAX_ROWS):
+        """
+        Returns the rows whose 'statistic label' contains the pattern, optionally for a single year group.
+
+        Args:
+            snapshot (dict): The dataset to query.
+            pattern (str): The substring the 'statistic label' must contain, matched literally.
+            year_group (str or None): The first year of the year group, or None for all of them.
+            limit (int): The maximum number of rows returned, capped at SERVICE_MAX_ROWS.
+
+        Returns:
+            pandas.DataFrame: The matching rows.
+
+        Raises:
+            ValueError: If the limit is negative.
+        """
+        if limit < 0:
+            raise ValueError('limit must not be negative: %d' % limit)
+        result = self._transformation.data_filter(snapshot['data'], pattern, snapshot['index'])
+        if year_group is not None:
+            result = result[result['year_group'] == int(year_group)]
+        return result.head(min(limit, SERVICE_MAX_ROWS))
+
+
+class DataServiceRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves the queries of a DataService as JSON.
+
+    Responses carry the version of the dataset as their ETag and answer If-None-Match with 304.
+
+    Attributes:
+        service (DataService): The service answering the queries, set on the server.
+
+    Methods:
+        do_GET: Answers a query.
+    """
+    def do_GET(self):
+        """
+        Answers a query.
+
+        Returns:
+            None
+        """
+        parts = urlsplit(self.path)
+        params = {name: values[-1] for name, values in parse_qs(parts.query).items()}
+        try:
+            body, version = self.server.service.query(parts.path, params)
+        except KeyError:
+            return self._send_json(404, {'error': 'Unknown endpoint %s' % parts.path})
+        except ValueError as e:
+            return self._send_json(400, {'error': str(e)})
+        except RuntimeError as e:
+            return self._send_json(503, {'error': str(e)})
+        etag = '"%s"' % version
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, payload):
+        """
+        Sends an error response.
+
+        Args:
+            status (int): The HTTP status code.
+            payload (dict): The JSON payload.
+        """
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """
+        Writes the access log through the logging module.
+        """
+        logging.debug('%s - %s', self.address_string(), format % args)
+
+
+def create_server(service, host='0.0.0.0', port=SERVICE_PORT):
+    """
+    Creates the HTTP server of a DataService.
+
+    Args:
+        service (DataService): The service answering the queries.
+        host (str): The address to listen on.
+        port (int): The port to listen on, 0 for any free port.
+
+    Returns:
+        http.server.ThreadingHTTPServer: The server, not yet serving.
+    """
+    server = ThreadingHTTPServer((host, port), DataServiceRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serves the EDA14 aggregates and filtered slices over HTTP.')
+    parser.add_argument('--url', default=SERVICE_DATASET_URL)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=SERVICE_PORT)
+    parser.add_argument('--refresh-interval', type=float, default=SERVICE_REFRESH_INTERVAL)
+    parser.add_argument('--cache-dir', default=None, help='Directory of the download cache used by refreshes.')
+    args = parser.parse_args()
+
+    configure_logging()
+    cache = DownloadCache(args.cache_dir) if args.cache_dir else None
+    service = DataService(args.url, DataPipeline(cache))
+    service.refresh()
+    service.start_refresh(args.refresh_interval)
+    server = create_server(service, args.host, args.port)
+    logging.info('Serving on %s:%d', args.host, args.port)
+    try:
+        server.serve_forever()
+    finally:
+        service.stop_refresh()
+        server.server_close()
@@ -1,35 +1,70 @@
 import logging
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from data_metrics import measure
+
+# Number of CSV rows read per batch by the chunked transformation mode
+TRANSFORM_CHUNK_SIZE = 1000000
+# Columns shipped to the worker processes of the parallel transformation mode
+PARALLEL_COLUMNS = ['year_group', 'sex', 'value', 'statistic label']
+# Compute backends of DataTransformation: pandas DataFrames, or pyarrow Tables with pyarrow.compute kernels
+TRANSFORM_BACKENDS = ('pandas', 'arrow')
+# Default dimensions of the rollup cube, with the bucket width of the numeric ones
+CUBE_DIMENSIONS = ['year', 'sex', 'type of school', 'statistic label']
+CUBE_BUCKET_WIDTHS = {'year': 1}
+# Substring of the 'statistic label' kept by data_filter, and by the filtered output of every transformation mode
+FILTER_PATTERN = 'First Year'
+
 
 class DataTransformation:
     _filter_data: object
 
-    def __init__(self):
+    def __init__(self, metrics=None, backend='pandas'):
         """
         Initializes a new instance of the DataTransformation class.
 
         This class provides methods to perform data transformation on a DataFrame.
 
+        With the 'arrow' backend, data_transform keeps the data as a pyarrow Table from end to end and runs the
+        rename, aggregation and filter steps with multithreaded pyarrow.compute kernels. The lower-level methods
+        accept either a DataFrame or a Table and run on the matching library.
+
+        Args:
+            metrics (PipelineMetrics or None): The collector of per-stage metrics, or None to skip measuring.
+            backend (str): 'pandas' or 'arrow'.
+
         Attributes:
             _agg_group_year_data (pandas.DataFrame or None): The transformed DataFrame with grouped and aggregated data.
             _data (pandas.DataFrame or None): The input DataFrame for transformation.
             data_lowercase (pandas.DataFrame or None): The DataFrame with lowercase column names.
         """
+        if backend not in TRANSFORM_BACKENDS:
+            raise ValueError('Unsupported transformation backend: ' + str(backend))
         self._agg_group_year_data = None
         self._data = None
         self.data_lowercase = None
+        self._metrics = metrics
+        self._backend = backend
 
     def all_column_lower_case(self, lowercdata):
         """
         Converts all column names in the DataFrame to lowercase.
 
         Args:
-            lowercdata (pandas.DataFrame): The DataFrame to convert.
+            lowercdata (pandas.DataFrame or pyarrow.Table): The DataFrame to convert.
 
         Returns:
-            pandas.DataFrame: The DataFrame with lowercase column names.
+            pandas.DataFrame or pyarrow.Table: The DataFrame with lowercase column names, a new Table for a Table.
 
         """
         self._data = lowercdata
+        if isinstance(lowercdata, pa.Table):
+            return lowercdata.rename_columns([name.lower() for name in lowercdata.column_names])
         lowercdata.columns = lowercdata.columns.str.lower()
         return lowercdata
 
@@ -38,59 +73,665 @@ class DataTransformation:
         Groups the DataFrame by 'year_group' and aggregates the 'value' column by sum for different sexes.
 
         Args:
-            data_lowercase (pandas.DataFrame): The DataFrame to perform grouping and aggregation on.
+            data_lowercase (pandas.DataFrame or pyarrow.Table): The DataFrame to perform grouping and aggregation on.
 
         Returns:
-            pandas.DataFrame: The resulting DataFrame with grouped and aggregated data.
+            pandas.DataFrame or pyarrow.Table: The resulting DataFrame with grouped and aggregated data. For a Table,
+            a Table with a 'year_group' column sorted by year group.
 
         """
         self._data = data_lowercase
+        if isinstance(data_lowercase, pa.Table):
+            return self.sum_by_sex(self._with_year_group(data_lowercase), 'year_group')
         self._data['year'] = self._data['year'].astype(int)
         self._data['year_group'] = self._data['year'] // 5 * 5
 
-        # Group by 'year_group' and aggregate the 'value' column by sum for different sexes
-        self._data = self._data.groupby(['year_group']).agg(female=('value',
-                                                                    lambda x: x[self._data['sex'] == 'Female'].sum()),
-                                                            male=(
-                                                                'value',
-                                                                lambda x: x[self._data['sex'] == 'Male'].sum()),
-                                                            both_sexes=(
-                                                                'value', 'sum'))
+        # Mask the 'value' column per sex and sum all three columns in a single grouped pass
+        self._data = self.sum_by_sex(self._data, 'year_group')
         return self._data
 
-    def data_filter(self, filter_data):
+    def sum_by_sex(self, data_lowercase, key):
         """
-        Filters the DataFrame based on the 'statistic label' column containing 'First Year'.
+        Sums the 'value' column by sex for every distinct value of the given key column.
 
         Args:
-            filter_data (pandas.DataFrame): The DataFrame to filter.
+            data_lowercase (pandas.DataFrame or pyarrow.Table): The DataFrame with lowercase column names.
+            key (str): The column to group by.
 
         Returns:
-            pandas.DataFrame: The filtered DataFrame.
+            pandas.DataFrame or pyarrow.Table: A DataFrame indexed by the key with 'female', 'male' and
+            'both_sexes' columns. For a Table, a Table with the key column first, sorted by the key.
+
+        """
+        if isinstance(data_lowercase, pa.Table):
+            return self._sum_by_sex_arrow(data_lowercase, key)
+        value = data_lowercase['value']
+        if value.dtype == 'float32':
+            # Compact float32 values are summed in float64 so large totals stay exact
+            value = value.astype('float64')
+        sex = data_lowercase['sex']
+        sums = pd.DataFrame({key: data_lowercase[key],
+                             'female': value.where(sex == 'Female', 0),
+                             'male': value.where(sex == 'Male', 0),
+                             'both_sexes': value})
+        return sums.groupby(key).sum()
+
+    def _sum_by_sex_arrow(self, table, key):
+        """
+        Sums the 'value' column by sex for every distinct value of the key column of a Table, with if_else masks
+        and a single hash aggregation.
+
+        Args:
+            table (pyarrow.Table): The Table with lowercase column names.
+            key (str): The column to group by.
+
+        Returns:
+            pyarrow.Table: The key followed by the 'female', 'male' and 'both_sexes' sums, sorted by the key.
+        """
+        value = pc.cast(table['value'], pa.float64())
+        sex = table['sex']
+        sums = pa.table({key: table[key],
+                         'female': pc.if_else(pc.fill_null(pc.equal(sex, 'Female'), False), value, 0.0),
+                         'male': pc.if_else(pc.fill_null(pc.equal(sex, 'Male'), False), value, 0.0),
+                         'both_sexes': value})
+        # min_count=0 gives 0 rather than null for groups without values, like pandas
+        options = pc.ScalarAggregateOptions(min_count=0)
+        columns = ['female', 'male', 'both_sexes']
+        result = sums.group_by(key).aggregate([(column, 'sum', options) for column in columns])
+        result = result.select([key] + [column + '_sum' for column in columns]).rename_columns([key] + columns)
+        return result.sort_by(key)
+
+    def _with_year_group(self, table):
+        """
+        Casts the 'year' column of a Table to integers and appends the 5-year 'year_group' column.
+
+        Args:
+            table (pyarrow.Table): The Table with lowercase column names.
+
+        Returns:
+            pyarrow.Table: A new Table with the integer 'year' and the 'year_group' columns.
+        """
+        year = pc.cast(table['year'], pa.int64())
+        table = table.set_column(table.schema.get_field_index('year'), 'year', year)
+        return table.append_column('year_group', pc.multiply(pc.divide(year, 5), 5))
+
+    def build_index(self, data, column='statistic label'):
+        """
+        Builds a dictionary index of a column, reusable by several data_filter calls on the same DataFrame.
+
+        Args:
+            data (pandas.DataFrame): The DataFrame holding the column.
+            column (str): The column to index.
+
+        Returns:
+            ValueIndex: The index of the column.
+
+        """
+        return ValueIndex(data[column])
+
+    def data_filter(self, filter_data, pattern=FILTER_PATTERN, index=None):
+        """
+        Filters the DataFrame based on the 'statistic label' column containing a pattern, FILTER_PATTERN by default.
+
+        The pattern is matched once per distinct label through a ValueIndex and rows are then selected by their
+        integer code, instead of scanning the string of every row.
+
+        Args:
+            filter_data (pandas.DataFrame or pyarrow.Table): The DataFrame to filter.
+            pattern (str or callable): The substring the 'statistic label' must contain, or a predicate called
+                with the distinct labels that returns one boolean per label. Tables only take a substring.
+            index (ValueIndex or None): An index of the 'statistic label' column built by build_index on
+                filter_data, or None to build one. Ignored for Tables.
+
+        Returns:
+            pandas.DataFrame or pyarrow.Table: The filtered DataFrame.
 
         """
         self._data = filter_data
-        result_filter = self._data[self._data['statistic label'].str.contains('First Year')]
+        if isinstance(filter_data, pa.Table):
+            return filter_data.filter(self._substring_mask(filter_data['statistic label'], pattern))
+        if index is None:
+            index = self.build_index(self._data)
+        result_filter = self._data[index.mask(pattern)]
         return result_filter
 
+    def _substring_mask(self, column, pattern):
+        """
+        Returns the rows of an Arrow column containing a substring, matching dictionary-encoded chunks once per
+        distinct value with match_substring and selecting rows by their dictionary index.
+
+        Args:
+            column (pyarrow.ChunkedArray): The string or dictionary-encoded string column.
+            pattern (str): The substring to look for.
+
+        Returns:
+            pyarrow.ChunkedArray: The boolean mask of the matching rows. Missing values never match.
+        """
+        if not pa.types.is_dictionary(column.type):
+            return pc.fill_null(pc.match_substring(column, pattern), False)
+        chunks = [pc.take(pc.fill_null(pc.match_substring(chunk.dictionary, pattern), False), chunk.indices)
+                  for chunk in column.chunks]
+        return pc.fill_null(pa.chunked_array(chunks, pa.bool_()), False)
+
+    def plan(self):
+        """
+        Starts a lazy transformation plan on this instance.
+
+        Returns:
+            TransformationPlan: An empty plan whose operations run only when it is executed.
+        """
+        return TransformationPlan(self)
+
+    def build_cube(self, data, dimensions=None, bucket_widths=None, measure_column='value'):
+        """
+        Builds a rollup cube of the sum and count of a measure over several dimensions in a single grouped pass.
+
+        Args:
+            data (pandas.DataFrame): The DataFrame with lowercase column names.
+            dimensions (list or None): The dimension columns, or None for CUBE_DIMENSIONS.
+            bucket_widths (dict or None): The bucket width of every numeric dimension, e.g. {'year': 1}, or None
+                for CUBE_BUCKET_WIDTHS. Queries can only use multiples of these widths.
+            measure_column (str): The column that is summed.
+
+        Returns:
+            RollupCube: The cube, whose size depends on the number of distinct dimension values, not on rows.
+
+        """
+        dimensions = list(CUBE_DIMENSIONS if dimensions is None else dimensions)
+        bucket_widths = dict(CUBE_BUCKET_WIDTHS if bucket_widths is None else bucket_widths)
+        with measure(self._metrics, 'transform:cube', len(data)) as record:
+            keys = {}
+            for dimension in dimensions:
+                keys[dimension] = data[dimension]
+                if dimension in bucket_widths:
+                    width = bucket_widths[dimension]
+                    keys[dimension] = data[dimension].astype('int64') // width * width
+            value = data[measure_column]
+            if value.dtype == 'float32':
+                value = value.astype('float64')
+            frame = pd.DataFrame(dict(keys, sum=value, count=value.notna().astype('int64')))
+            cells = frame.groupby(dimensions, observed=True, dropna=False, sort=False).sum().reset_index()
+            record['rows_out'] = len(cells)
+        return RollupCube(cells, dimensions, bucket_widths, measure_column)
+
     def data_transform(self, data):
         """
         Performs data transformation on the specified DataFrame.
 
         Args:
-            data (pandas.DataFrame): The DataFrame to transform.
+            data (pandas.DataFrame or pyarrow.Table): The DataFrame to transform. With the 'arrow' backend a
+                DataFrame is converted to a Table once.
 
         Returns:
             Tuple[pandas.DataFrame, pandas.DataFrame]: A tuple containing the transformed DataFrame with grouped and
-            aggregated data, and the filtered DataFrame.
+            aggregated data, and the filtered DataFrame. Both are pyarrow Tables with the 'arrow' backend.
 
         """
         logging.info('************************************************************************************************')
         logging.info('Transforming the data')
+        if self._backend == 'arrow':
+            return self._data_transform_arrow(data)
         self._data = data
-        self.data_lowercase = self.all_column_lower_case(self._data)
-        self._agg_group_year_data = self.aggregator_group(self.data_lowercase)
-        self._filter_data = self.data_filter(self.data_lowercase)
+        with measure(self._metrics, 'transform:lower_case', len(data)):
+            self.data_lowercase = self.all_column_lower_case(self._data)
+        with measure(self._metrics, 'transform:aggregate', len(data)):
+            self._agg_group_year_data = self.aggregator_group(self.data_lowercase)
+        with measure(self._metrics, 'transform:filter', len(data)) as record:
+            self._filter_data = self.data_filter(self.data_lowercase)
+            record['rows_out'] = len(self._filter_data)
         logging.info('************************************************************************************************')
         return self._agg_group_year_data, self._filter_data
 
+    def _data_transform_arrow(self, data):
+        """
+        Performs data_transform on a pyarrow Table without converting it to pandas.
+
+        Args:
+            data (pandas.DataFrame or pyarrow.Table): The data to transform.
+
+        Returns:
+            Tuple[pyarrow.Table, pyarrow.Table]: The aggregated Table with a 'year_group' column, and the filtered
+            rows with the integer 'year' and the 'year_group' columns.
+        """
+        self._data = data if isinstance(data, pa.Table) else pa.Table.from_pandas(data, preserve_index=False)
+        with measure(self._metrics, 'transform:lower_case', len(self._data)):
+            self.data_lowercase = self._with_year_group(self.all_column_lower_case(self._data))
+        with measure(self._metrics, 'transform:aggregate', len(self._data)):
+            self._agg_group_year_data = self.sum_by_sex(self.data_lowercase, 'year_group')
+        with measure(self._metrics, 'transform:filter', len(self._data)) as record:
+            self._filter_data = self.data_filter(self.data_lowercase)
+            record['rows_out'] = len(self._filter_data)
+        logging.info('************************************************************************************************')
+        return self._agg_group_year_data, self._filter_data
+
+    def merge_partials(self, total, partial):
+        """
+        Merges two partial aggregates produced by sum_by_sex on disjoint row sets.
+
+        Args:
+            total (pandas.DataFrame or None): The aggregate accumulated so far, or None for the first partial.
+            partial (pandas.DataFrame): The aggregate of the next row set.
+
+        Returns:
+            pandas.DataFrame: The combined aggregate.
+
+        """
+        if total is None:
+            return partial
+        return pd.concat([total, partial]).groupby(level=0).sum()
+
+    def data_transform_chunked(self, source, filter_destination, chunksize=TRANSFORM_CHUNK_SIZE, validator=None):
+        """
+        Performs data transformation on a CSV file one batch of rows at a time.
+
+        Partial year_group/sex sums are merged as each batch is read and the filtered rows are appended to the
+        output file straight away, so peak memory depends on the chunk size rather than on the dataset size.
+        With a fail-fast validator, a bad file stops at its first bad batch.
+
+        Args:
+            source (str or file-like): The path to the CSV file or a readable buffer.
+            filter_destination (str): The path of the CSV file receiving the filtered rows.
+            chunksize (int): The number of rows read per batch.
+            validator (StreamingValidator or None): Validates every batch before it is transformed, or None to skip
+                validation.
+
+        Returns:
+            Tuple[pandas.DataFrame, int]: A tuple containing the transformed DataFrame with grouped and aggregated
+            data, and the number of filtered rows written.
+
+        """
+        logging.info('************************************************************************************************')
+        logging.info('Transforming the data in chunks of %d rows', chunksize)
+        self._agg_group_year_data = None
+        filtered_rows = 0
+        with pd.read_csv(source, sep=',', header=0, encoding='utf-8', chunksize=chunksize) as reader:
+            for chunk_number, chunk in enumerate(reader):
+                if validator is not None:
+                    validator.update(chunk)
+                self.data_lowercase = self.all_column_lower_case(chunk)
+                partial = self.aggregator_group(self.data_lowercase)
+                self._agg_group_year_data = self.merge_partials(self._agg_group_year_data, partial)
+                self._filter_data = self.data_filter(self.data_lowercase)
+                self._filter_data.to_csv(filter_destination, index=False, mode='w' if chunk_number == 0 else 'a',
+                                         header=chunk_number == 0)
+                filtered_rows += len(self._filter_data)
+        if validator is not None:
+            validator.finish()
+        logging.info('************************************************************************************************')
+        return self._agg_group_year_data, filtered_rows
+
+    def year_fingerprints(self, data_lowercase):
+        """
+        Computes an order-independent fingerprint of the rows of every year.
+
+        Args:
+            data_lowercase (pandas.DataFrame): The DataFrame with lowercase column names.
+
+        Returns:
+            pandas.Series: The fingerprint of each year, indexed by year.
+
+        """
+        row_hashes = pd.util.hash_pandas_object(data_lowercase, index=False)
+        return row_hashes.groupby(data_lowercase['year'].to_numpy()).sum()
+
+    def data_transform_incremental(self, data, state=None):
+        """
+        Performs data transformation on the years that are new or changed since the previous run only.
+
+        The state holds a fingerprint and the female/male/both_sexes partial sums of every year already processed.
+        Only the rows of years whose fingerprint changed are aggregated and filtered; the year_group aggregate is
+        then rebuilt from the per-year partial sums kept in the state.
+
+        Args:
+            data (pandas.DataFrame): The DataFrame to transform.
+            state (dict or None): The state returned by the previous run, or None for a first run.
+
+        Returns:
+            Tuple[pandas.DataFrame, pandas.DataFrame, dict]: A tuple containing the transformed DataFrame with
+            grouped and aggregated data, the filtered rows of the changed years, and the new state. The new state
+            lists the changed and removed years under 'changed_years'.
+
+        """
+        logging.info('************************************************************************************************')
+        logging.info('Transforming the new and changed years')
+        previous_years = (state or {}).get('years', {})
+        self.data_lowercase = self.all_column_lower_case(data)
+        self.data_lowercase['year'] = self.data_lowercase['year'].astype(int)
+        fingerprints = self.year_fingerprints(self.data_lowercase)
+
+        years = {}
+        changed_years = []
+        for year, fingerprint in fingerprints.items():
+            previous = previous_years.get(str(year))
+            if previous is not None and previous['fingerprint'] == str(fingerprint):
+                years[str(year)] = previous
+            else:
+                changed_years.append(int(year))
+        changed_years += [int(year) for year in previous_years if int(year) not in fingerprints.index]
+        logging.info('Changed years: %s', changed_years)
+
+        delta = self.data_lowercase[self.data_lowercase['year'].isin(changed_years)].copy()
+        delta['year_group'] = delta['year'] // 5 * 5
+        for year, sums in self.sum_by_sex(delta, 'year').iterrows():
+            years[str(year)] = {'fingerprint': str(fingerprints[year]), 'female': sums['female'].item(),
+                                'male': sums['male'].item(), 'both_sexes': sums['both_sexes'].item()}
+        self._filter_data = self.data_filter(delta)
+
+        year_sums = pd.DataFrame.from_dict(years, orient='index', columns=['female', 'male', 'both_sexes'])
+        year_sums['year_group'] = year_sums.index.astype(int) // 5 * 5
+        self._agg_group_year_data = year_sums.groupby('year_group').sum().sort_index()
+        logging.info('************************************************************************************************')
+        return self._agg_group_year_data, self._filter_data, {'years': years, 'changed_years': sorted(changed_years)}
+
+
+
+    def data_transform_parallel(self, data, workers=None, pattern=FILTER_PATTERN):
+        """
+        Performs data transformation on the specified DataFrame with a pool of worker processes.
+
+        The columns needed by the aggregation and the filter are written once to a temporary Arrow IPC file that
+        every worker memory-maps, so the data is shared through the page cache instead of being pickled. Each
+        worker aggregates and filters one block of rows and returns its partial sums and the positions of its
+        matching rows, which are then merged.
+
+        Args:
+            data (pandas.DataFrame): The DataFrame to transform.
+            workers (int or None): The number of worker processes, os.cpu_count() by default.
+            pattern (str): The substring the 'statistic label' must contain.
+
+        Returns:
+            Tuple[pandas.DataFrame, pandas.DataFrame]: A tuple containing the transformed DataFrame with grouped and
+            aggregated data, and the filtered DataFrame.
+
+        """
+        logging.info('************************************************************************************************')
+        workers = workers or os.cpu_count() or 1
+        logging.info('Transforming the data with %d worker processes', workers)
+        self.data_lowercase = self.all_column_lower_case(data)
+        self.data_lowercase['year'] = self.data_lowercase['year'].astype(int)
+        self.data_lowercase['year_group'] = self.data_lowercase['year'] // 5 * 5
+
+        rows = len(self.data_lowercase)
+        block_size = max(-(-rows // workers), 1)
+        fd, arrow_path = tempfile.mkstemp(suffix='.arrow')
+        os.close(fd)
+        try:
+            table = pa.Table.from_pandas(self.data_lowercase[PARALLEL_COLUMNS], preserve_index=False)
+            with pa.OSFile(arrow_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+            del table
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(_transform_block, arrow_path, start, min(start + block_size, rows), pattern)
+                           for start in range(0, rows, block_size)]
+                results = [future.result() for future in futures]
+        finally:
+            os.remove(arrow_path)
+
+        self._agg_group_year_data = None
+        for partial, _ in results:
+            self._agg_group_year_data = self.merge_partials(self._agg_group_year_data, partial)
+        positions = np.concatenate([block_positions for _, block_positions in results]) if results else []
+        self._filter_data = self.data_lowercase.iloc[positions]
+        logging.info('************************************************************************************************')
+        return self._agg_group_year_data, self._filter_data
+
+
+def _transform_block(arrow_path, start, stop, pattern):
+    """
+    Aggregates and filters one block of rows of a memory-mapped Arrow IPC file in a worker process.
+
+    Args:
+        arrow_path (str): The path to the Arrow IPC file holding the PARALLEL_COLUMNS.
+        start (int): The position of the first row of the block.
+        stop (int): The position after the last row of the block.
+        pattern (str): The substring the 'statistic label' must contain.
+
+    Returns:
+        Tuple[pandas.DataFrame, numpy.ndarray]: The partial sums of the block and the positions of its rows that
+        match the pattern.
+    """
+    with pa.memory_map(arrow_path, 'r') as source:
+        block = pa.ipc.open_file(source).read_all().slice(start, stop - start).to_pandas()
+    transformation = DataTransformation()
+    partial = transformation.sum_by_sex(block, 'year_group')
+    positions = np.flatnonzero(ValueIndex(block['statistic label']).mask(pattern)) + start
+    return partial, positions
+
+
+class ValueIndex:
+    """
+    A dictionary index of a column: one integer code per row plus the distinct values the codes refer to.
+
+    Categorical columns are indexed for free from their codes and categories; other columns are factorized once.
+    A predicate is then evaluated once per distinct value and rows are selected by a lookup on their code.
+
+    Attributes:
+        _codes (numpy.ndarray): The code of every row, -1 for missing values.
+        _values (pandas.Index): The distinct values.
+
+    Methods:
+        mask: Returns the boolean row mask of a predicate.
+    """
+    def __init__(self, column):
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            self._codes = column.cat.codes.to_numpy()
+            self._values = column.cat.categories
+        else:
+            self._codes, self._values = pd.factorize(column)
+            self._values = pd.Index(self._values)
+
+    def mask(self, predicate):
+        """
+        Returns the rows whose value satisfies the predicate.
+
+        Args:
+            predicate (str or callable): A substring the value must contain, or a function called with the
+                pandas.Index of distinct values that returns one boolean per value.
+
+        Returns:
+            numpy.ndarray: The boolean mask of the matching rows. Missing values never match.
+        """
+        if callable(predicate):
+            matches = np.asarray(predicate(self._values), dtype=bool)
+        else:
+            matches = np.asarray(self._values.astype(str).str.contains(predicate, regex=False), dtype=bool)
+        # The extra False entry is picked by the -1 code of missing values
+        return np.append(matches, False)[self._codes]
+
+
+class TransformationPlan:
+    """
+    A lazy transformation plan: operations are collected first and run in a single pass over a CSV source.
+
+    Only the projection is pushed down into the CSV read: the columns the operations need are parsed through
+    usecols. The filter predicates are not pushed down; every row is still parsed and the predicates are applied
+    to each chunk as it is read, so rows that do not match are dropped before the chunks are combined.
+
+    Attributes:
+        _transformation (DataTransformation): The instance running the aggregation and filter steps.
+        _operations (list): The collected operations, as ('aggregate', None) or ('filter', (pattern, columns)).
+
+    Methods:
+        aggregate: Adds the year_group/sex aggregation to the plan.
+        filter: Adds a 'statistic label' filter to the plan.
+        required_columns: Returns the lowercase columns the plan needs.
+        execute: Runs the plan on a CSV source.
+    """
+    def __init__(self, transformation):
+        self._transformation = transformation
+        self._operations = []
+
+    def aggregate(self):
+        """
+        Adds the year_group/sex aggregation of DataTransformation.aggregator_group to the plan.
+
+        Returns:
+            TransformationPlan: This plan.
+        """
+        self._operations.append(('aggregate', None))
+        return self
+
+    def filter(self, pattern=FILTER_PATTERN, columns=None):
+        """
+        Adds a filter on the 'statistic label' column to the plan.
+
+        Args:
+            pattern (str): The substring the 'statistic label' must contain.
+            columns (list or None): The lowercase output columns, or None to keep every column.
+
+        Returns:
+            TransformationPlan: This plan.
+        """
+        self._operations.append(('filter', (pattern, None if columns is None else [c.lower() for c in columns])))
+        return self
+
+    def required_columns(self):
+        """
+        Returns the lowercase columns that must be read to execute the plan.
+
+        Returns:
+            set or None: The required columns, or None when every column is needed.
+        """
+        required = set()
+        for operation, arguments in self._operations:
+            if operation == 'aggregate':
+                required.update(['year', 'sex', 'value'])
+            else:
+                pattern, columns = arguments
+                if columns is None:
+                    return None
+                required.add('statistic label')
+                required.update(column for column in columns if column != 'year_group')
+                if 'year_group' in columns:
+                    required.add('year')
+        return required
+
+    def execute(self, source, chunksize=TRANSFORM_CHUNK_SIZE):
+        """
+        Runs the plan in a single pass over a CSV source.
+
+        Args:
+            source (str or file-like): The path to the CSV file or a readable buffer.
+            chunksize (int): The number of rows read per batch.
+
+        Returns:
+            list: One result per operation, in the order they were added: the aggregated DataFrame for
+            aggregate() and the filtered DataFrame for filter().
+        """
+        required = self.required_columns()
+        usecols = None if required is None else (lambda column: column.lower() in required)
+        logging.info('Executing a plan of %d operations reading columns %s', len(self._operations),
+                     'all' if required is None else sorted(required))
+        aggregated = None
+        filtered = [[] for _ in self._operations]
+        with pd.read_csv(source, sep=',', header=0, encoding='utf-8', usecols=usecols,
+                         chunksize=chunksize) as reader:
+            for chunk in reader:
+                chunk = self._transformation.all_column_lower_case(chunk)
+                if 'year' in chunk.columns:
+                    chunk['year'] = chunk['year'].astype(int)
+                    chunk['year_group'] = chunk['year'] // 5 * 5
+                label_index = None
+                for position, (operation, arguments) in enumerate(self._operations):
+                    if operation == 'aggregate':
+                        aggregated = self._transformation.merge_partials(
+                            aggregated, self._transformation.sum_by_sex(chunk, 'year_group'))
+                    else:
+                        pattern, columns = arguments
+                        if label_index is None:
+                            label_index = self._transformation.build_index(chunk)
+                        matched = self._transformation.data_filter(chunk, pattern, label_index)
+                        filtered[position].append(matched if columns is None else matched[columns])
+
+        results = []
+        for position, (operation, _) in enumerate(self._operations):
+            if operation == 'aggregate':
+                results.append(aggregated)
+            else:
+                results.append(pd.concat(filtered[position], ignore_index=True))
+        return results
+
+
+class RollupCube:
+    """
+    A rollup cube: the sum and count of a measure for every combination of dimension values present in the data.
+
+    Any group-by over a subset of the dimensions, with numeric dimensions re-bucketed to coarser widths and filters
+    on any dimension, is answered by aggregating the cells of the cube, so it costs O(cube size) instead of a scan of
+    the raw rows.
+
+    Attributes:
+        cells (pandas.DataFrame): One row per cell with its dimension values, 'sum' and 'count'.
+        dimensions (list): The dimension columns.
+        bucket_widths (dict): The bucket width of every numeric dimension.
+        measure_column (str): The column that was summed.
+
+    Methods:
+        query: Aggregates the cube by some of its dimensions.
+        year_group_by_sex: Returns the aggregate of aggregator_group from the cube.
+    """
+    def __init__(self, cells, dimensions, bucket_widths, measure_column):
+        self.cells = cells
+        self.dimensions = dimensions
+        self.bucket_widths = bucket_widths
+        self.measure_column = measure_column
+
+    def query(self, by, widths=None, filters=None):
+        """
+        Aggregates the cube by some of its dimensions.
+
+        Args:
+            by (list): The dimensions to group by, e.g. ['year', 'sex'].
+            widths (dict or None): The bucket width of numeric dimensions, e.g. {'year': 5}. Each width must be a
+                multiple of the width the cube was built with.
+            filters (dict or None): A value, a list of values or a predicate on the values, by dimension.
+
+        Returns:
+            pandas.DataFrame: The 'sum' and 'count' of the measure, indexed by the group-by dimensions.
+
+        Raises:
+            KeyError: If a dimension is not part of the cube.
+            ValueError: If a width is not a multiple of the width of the cube.
+        """
+        by = list(by)
+        widths = widths or {}
+        for dimension in list(by) + list(widths) + list(filters or {}):
+            if dimension not in self.dimensions:
+                raise KeyError('%s is not a dimension of the cube' % dimension)
+        cells = self.cells
+        for dimension, condition in (filters or {}).items():
+            if callable(condition):
+                mask = np.asarray(condition(cells[dimension]), dtype=bool)
+            elif isinstance(condition, (list, tuple, set)):
+                mask = cells[dimension].isin(list(condition))
+            else:
+                mask = cells[dimension] == condition
+            cells = cells[mask]
+        keys = {}
+        for dimension in by:
+            keys[dimension] = cells[dimension]
+            if dimension in widths:
+                base_width = self.bucket_widths.get(dimension)
+                if base_width is None or widths[dimension] % base_width:
+                    raise ValueError('The width of %s must be a multiple of %s' % (dimension, base_width))
+                keys[dimension] = cells[dimension] // widths[dimension] * widths[dimension]
+        if not by:
+            return cells[['sum', 'count']].sum().to_frame().T
+        grouped = pd.DataFrame(dict(keys, sum=cells['sum'], count=cells['count']))
+        return grouped.groupby(by, observed=True, dropna=False).sum()
+
+    def year_group_by_sex(self, width=5):
+        """
+        Returns the aggregate of aggregator_group from the cube.
+
+        Args:
+            width (int): The number of years per year group.
+
+        Returns:
+            pandas.DataFrame: A DataFrame indexed by 'year_group' with 'female', 'male' and 'both_sexes' columns.
+        """
+        by_sex = self.query(['year', 'sex'], {'year': width})['sum'].unstack('sex')
+        result = pd.DataFrame({'female': by_sex.get('Female', 0.0), 'male': by_sex.get('Male', 0.0),
+                               'both_sexes': by_sex.sum(axis=1)}, index=by_sex.index).fillna(0.0)
+        result.index = result.index.astype('int64').rename('year_group')
+        return result.sort_index()
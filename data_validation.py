@@ -1,4 +1,185 @@
 import logging
+import pandas as pd
+import pyarrow as pa
+from data_logging import summarize, SUMMARY_MAX_COLUMNS
+from data_metrics import measure
+
+# Expected dtype of every column of the EDA14 dataset when parsed with default dtypes
+COLUMN_TYPES = {'STATISTIC': object, 'Statistic Label': object, 'C02351V02955': int,
+                'Type of School': object, 'C02199V02655': object, 'Sex': object, 'TLIST(A1)': int,
+                'Year': int, 'UNIT': object, 'VALUE': float}
+
+# Compact dtype of every column of the EDA14 dataset: low-cardinality codes as categoricals, narrow numbers
+COMPACT_COLUMN_TYPES = {'STATISTIC': 'category', 'Statistic Label': 'category', 'C02351V02955': 'int32',
+                        'Type of School': 'category', 'C02199V02655': 'category', 'Sex': 'category',
+                        'TLIST(A1)': 'int16', 'Year': 'int16', 'UNIT': 'category', 'VALUE': 'float32'}
+# Kind of values expected in every column by the streaming validation, whatever dtypes the parser picked
+COLUMN_KINDS = {'STATISTIC': 'text', 'Statistic Label': 'text', 'C02351V02955': 'integer', 'Type of School': 'text',
+                'C02199V02655': 'text', 'Sex': 'text', 'TLIST(A1)': 'integer', 'Year': 'integer', 'UNIT': 'text',
+                'VALUE': 'number'}
+# Columns the transformation cannot process with missing values
+NON_NULLABLE_COLUMNS = ('Year', 'Sex')
+
+
+class ValidationError(Exception):
+    """
+    Raised by fail-fast validation when a batch breaks the expected schema.
+
+    Attributes:
+        report (dict): The validation report at the time of the failure.
+    """
+    def __init__(self, report):
+        super().__init__('; '.join(report['errors']))
+        self.report = report
+
+
+class StreamingValidator:
+    """
+    Validates data batch by batch, computing schema conformance, null counts and record counts in one pass.
+
+    Column names are matched case-insensitively, so batches can be validated before or after their columns are
+    lowercased. pandas DataFrames and pyarrow Tables or RecordBatches are both accepted; for Arrow data the null
+    counts come from the column metadata without a scan.
+
+    Attributes:
+        _kinds (dict): The expected kind of every column ('text', 'integer' or 'number'), by lowercase name.
+        _non_nullable (set): The lowercase names of the columns that must not contain missing values.
+        _min_records (int): The minimum number of records of the whole stream.
+        _fail_fast (bool): Whether update raises ValidationError on the first bad batch.
+        _report (dict): The report accumulated so far.
+
+    Methods:
+        update: Validates one batch.
+        finish: Runs the whole-stream checks and returns the report.
+        report: Returns the report accumulated so far.
+    """
+    def __init__(self, column_kinds=None, non_nullable=NON_NULLABLE_COLUMNS, min_records=1, fail_fast=True):
+        self._kinds = {column.lower(): kind for column, kind in (column_kinds or COLUMN_KINDS).items()}
+        self._non_nullable = {column.lower() for column in non_nullable}
+        self._min_records = min_records
+        self._fail_fast = fail_fast
+        self._report = {'passed': True, 'records': 0, 'batches': 0, 'schema': {}, 'null_counts': {}, 'errors': []}
+
+    def update(self, batch):
+        """
+        Validates one batch and adds its counts to the report.
+
+        Args:
+            batch (pandas.DataFrame, pyarrow.Table or pyarrow.RecordBatch): The batch to validate.
+
+        Returns:
+            list: The errors found in the batch.
+
+        Raises:
+            ValidationError: If the batch has errors and the validator fails fast.
+        """
+        report = self._report
+        if isinstance(batch, (pa.Table, pa.RecordBatch)):
+            columns = {field.name.lower(): (self._arrow_kind(field.type), str(field.type))
+                       for field in batch.schema}
+            null_counts = {field.name.lower(): batch.column(index).null_count
+                           for index, field in enumerate(batch.schema)}
+        else:
+            columns = {str(name).lower(): (self._pandas_kind(dtype), str(dtype))
+                       for name, dtype in batch.dtypes.items()}
+            null_counts = dict(zip([str(name).lower() for name in batch.columns], batch.isna().sum().tolist()))
+        errors = []
+        batch_number = report['batches']
+        for column, kind in self._kinds.items():
+            if column not in columns:
+                errors.append('Batch %d: column %s is missing' % (batch_number, column))
+                continue
+            actual_kind, dtype = columns[column]
+            report['schema'].setdefault(column, dtype)
+            # Integers are valid numbers, and codes in text columns may have been parsed as numbers
+            compatible = actual_kind == kind or kind == 'text' or (kind == 'number' and actual_kind == 'integer')
+            if not compatible:
+                errors.append('Batch %d: column %s has dtype %s, expected %s' % (batch_number, column, dtype, kind))
+        for column, null_count in null_counts.items():
+            report['null_counts'][column] = report['null_counts'].get(column, 0) + int(null_count)
+            if null_count and column in self._non_nullable:
+                errors.append('Batch %d: column %s has %d missing values' % (batch_number, column, null_count))
+        report['records'] += batch.num_rows if isinstance(batch, (pa.Table, pa.RecordBatch)) else len(batch)
+        report['batches'] += 1
+        self._add_errors(errors)
+        return errors
+
+    def finish(self):
+        """
+        Runs the checks on the whole stream and returns the report.
+
+        Returns:
+            dict: The report, see report.
+
+        Raises:
+            ValidationError: If the stream has errors and the validator fails fast.
+        """
+        if self._report['records'] < self._min_records:
+            self._add_errors(['Only %d records, expected at least %d' % (self._report['records'],
+                                                                         self._min_records)])
+        return self.report()
+
+    def report(self):
+        """
+        Returns the report accumulated so far.
+
+        Returns:
+            dict: Whether validation 'passed', the number of 'records' and 'batches', the dtype of every column
+            under 'schema', the number of missing values of every column under 'null_counts' and the 'errors'.
+        """
+        return self._report
+
+    def _add_errors(self, errors):
+        """
+        Records errors and raises when failing fast.
+
+        Args:
+            errors (list): The error messages.
+        """
+        if not errors:
+            return
+        self._report['errors'].extend(errors)
+        self._report['passed'] = False
+        for error in errors:
+            logging.info('Validation error :: %s', error)
+        if self._fail_fast:
+            raise ValidationError(self._report)
+
+    def _pandas_kind(self, dtype):
+        """
+        Returns the kind of values of a pandas dtype.
+
+        Args:
+            dtype: The pandas dtype.
+
+        Returns:
+            str: 'integer', 'number' or 'text'.
+        """
+        if isinstance(dtype, pd.CategoricalDtype):
+            return self._pandas_kind(dtype.categories.dtype)
+        if pd.api.types.is_integer_dtype(dtype):
+            return 'integer'
+        if pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype):
+            return 'number'
+        return 'text'
+
+    def _arrow_kind(self, arrow_type):
+        """
+        Returns the kind of values of an Arrow type.
+
+        Args:
+            arrow_type (pyarrow.DataType): The Arrow type.
+
+        Returns:
+            str: 'integer', 'number' or 'text'.
+        """
+        if pa.types.is_dictionary(arrow_type):
+            return self._arrow_kind(arrow_type.value_type)
+        if pa.types.is_integer(arrow_type):
+            return 'integer'
+        if pa.types.is_floating(arrow_type) or pa.types.is_decimal(arrow_type):
+            return 'number'
+        return 'text'
 
 
 class RecordCountValidator:
@@ -52,17 +233,21 @@ class DataValidator:
         _record_validator (RecordCountValidator): An instance of RecordCountValidator for record count validation.
         _sanity_validator (DataSanityValidator): An instance of DataSanityValidator for sanity validation.
         _validate_results (dict): A dictionary to store the validation results.
+        _metrics (PipelineMetrics or None): The collector of per-stage metrics, or None to skip measuring.
 
     Methods:
         validate: Performs data validation on the specified DataFrame.
+        streaming: Returns a StreamingValidator for batch-by-batch validation.
+        validate_stream: Validates a stream of batches in a single pass.
 
     """
-    def __init__(self):
+    def __init__(self, metrics=None):
         self._data = None
         self._data_validator = None
         self._record_validator = RecordCountValidator()
         self._sanity_validator = DataSanityValidator()
         self._validate_results = {}
+        self._metrics = metrics
 
     def validate(self, data):
         """
@@ -77,17 +262,56 @@ class DataValidator:
         """
         logging.info('************************************************************************************************')
         self._data = data
-        if self._record_validator.record_validate(self._data):
-            self._validate_results['Record_Validation'] = 'True'
-        else:
-            self._validate_results['Record_Validation'] = 'False'
-        if self._sanity_validator.perform_sanity_checks(self._data):
-            self._validate_results['Sanity_Validation'] = 'True'
-        else:
-            self._validate_results['Sanity_Validation'] = 'False'
+        with measure(self._metrics, 'validate', len(data)):
+            if self._record_validator.record_validate(self._data):
+                self._validate_results['Record_Validation'] = 'True'
+            else:
+                self._validate_results['Record_Validation'] = 'False'
+            if self._sanity_validator.perform_sanity_checks(self._data):
+                self._validate_results['Sanity_Validation'] = 'True'
+            else:
+                self._validate_results['Sanity_Validation'] = 'False'
         logging.info('************************************************************************************************')
         return self._validate_results
 
+    def streaming(self, fail_fast=True, **kwargs):
+        """
+        Returns a StreamingValidator for batch-by-batch validation inside another processing loop.
+
+        Args:
+            fail_fast (bool): Whether the first bad batch raises ValidationError.
+            **kwargs: Extra keyword arguments passed to StreamingValidator.
+
+        Returns:
+            StreamingValidator: A validator with an empty report.
+        """
+        return StreamingValidator(fail_fast=fail_fast, **kwargs)
+
+    def validate_stream(self, batches, fail_fast=True):
+        """
+        Validates a stream of batches in a single pass, stopping at the first bad batch when failing fast.
+
+        Args:
+            batches (iterable): pandas DataFrames or pyarrow Tables/RecordBatches, e.g. parse batches or the chunks
+                of pandas.read_csv. A single DataFrame can be passed as [data].
+            fail_fast (bool): Whether the first bad batch raises ValidationError.
+
+        Returns:
+            dict: The validation report, see StreamingValidator.report.
+
+        Raises:
+            ValidationError: If a batch has errors and fail_fast is True. Batches after it are not read.
+        """
+        validator = self.streaming(fail_fast)
+        with measure(self._metrics, 'validate_stream') as record:
+            try:
+                for batch in batches:
+                    validator.update(batch)
+                validator.finish()
+            finally:
+                record['rows'] = validator.report()['records']
+        return validator.report()
+
 
 class DataSanityValidator:
     """
@@ -118,12 +342,10 @@ class DataSanityValidator:
         """
         self._data = type_data
         self._data_type_check_result = {}
-        column_types = {'STATISTIC': object, 'Statistic Label': object, 'C02351V02955': int,
-                        'Type of School': object, 'C02199V02655': object, 'Sex': object, 'TLIST(A1)': int,
-                        'Year': int, 'UNIT': object, 'VALUE': float}
+        column_types = COLUMN_TYPES
         # Check data types of columns
         for column in self._data.columns:
-            logging.info(f"Column '{column}': {self._data[column].dtype}")
+            logging.debug("Column '%s': %s", column, self._data[column].dtype)
             if self._data[column].dtype == column_types[column]:
                 self._data_type_check_result[column]: True
             else:
@@ -145,8 +367,7 @@ class DataSanityValidator:
         # Check for missing values in columns
         self._data = missing_data
         missing_values = self._data.isnull().sum()
-        logging.info("Missing Values:")
-        logging.info(missing_values)
+        logging.info("Missing Values:\n%s", summarize(missing_values, max_rows=SUMMARY_MAX_COLUMNS))
         return missing_values
 
     def perform_sanity_checks(self, data):
@@ -164,12 +385,11 @@ class DataSanityValidator:
         flag_check = False
         sanity_results = self.check_data_types(self._data)
         missing_value_results = self.check_missing_values(self._data)
-        logging.info(sanity_results)
         if False in sanity_results:
             flag_check = True
-            logging.info('Sanity Validation failed ::'+ str(sanity_results))
+            logging.info('Sanity Validation failed :: %s', sanity_results)
         else:
-            logging.info('Sanity Validation passed ::'+ str(sanity_results))
+            logging.info('Sanity Validation passed :: %s', sanity_results)
         return flag_check
 
 